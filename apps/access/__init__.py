@@ -1,10 +1,11 @@
-import os
 import sys
 from collections import defaultdict
-from urllib.parse import urljoin
 from pathlib import Path
-import shutil
-import requests
+
+from apps.client import POOL_SIZE, concurrent_map
+from apps.runs import find_bams, get_run_details
+from apps.symlinks import reconcile_links
+from apps.trace import phase
 
 FLAG_TO_APPS = {
     "dmpmanifest": ("access_manifest", "manifest"),
@@ -20,31 +21,78 @@ def access_commands(arguments, config):
     print('Running ACCESS')
 
     request_ids, sample_id, apps, show_all_runs = get_arguments(arguments)
-    for request in request_ids:  
+    workers = int(arguments.get('--workers') or 1)
+    if workers > 1:
+        # share the connection pool between the requests linked at the same time
+        config = dict(config, workers=max(1, POOL_SIZE // workers))
+    jobs = [(request, app, app_version) for request in request_ids for (app, app_version) in apps]
+
+    def resolve(job):
+        request, app, app_version = job
+        (app_name, _) = FLAG_TO_APPS[app]
         tags = '{"cmoSampleIds":"%s"}' % sample_id if sample_id else '{"igoRequestId":"%s"}' % request
-        if arguments.get('link'):
-            for (app, app_version) in apps:
-                (app_name, directory) = FLAG_TO_APPS[app]
-                operator_run = get_operator_run(app_name, app_version, tags, config, show_all_runs)
-                if operator_run:
-                    if arguments.get('--single-dir'):
-                        if app == "bams":
-                            link_bams_to_single_dir(operator_run, app, request, sample_id, arguments, config, show_all_runs)
-                        else:
-                            print("Apps other than bams not supported at this time")
-                    else:
-                        link_app(operator_run, directory, request, sample_id, arguments, config, show_all_runs)
-
-        if arguments.get('link-patient'):
-            for (app, app_version) in apps:
-                (app_name, directory) = FLAG_TO_APPS[app]
-                operator_run = get_operator_run(app_name, app_version, tags, config, show_all_runs)
-                if operator_run:
-                    if(app == "bams"):
-                        link_bams_by_patient_id(operator_run, "bams", request, sample_id, arguments, config, show_all_runs)
-                    else:
-                        link_single_sample_workflows_by_patient_id(operator_run, directory, request, sample_id, arguments,
-                                                            config, show_all_runs)
+        try:
+            with phase('resolve'):
+                return job, get_operator_run(app_name, app_version, tags, config, show_all_runs), None
+        except Exception as e:
+            return job, None, "Failed to find operator run: %s" % e
+
+    def link(resolved):
+        (request, app, app_version), operator_run, error = resolved
+        if error:
+            return request, app, error
+        if not operator_run:
+            return request, app, "No operator run"
+        try:
+            link_operator_run(operator_run, app, request, sample_id, arguments, config, show_all_runs)
+        except Exception as e:
+            return request, app, "Failed: %s" % e
+        return request, app, "Linked"
+
+    # resolve every (request, app) operator run before linking any of them
+    resolved = list(concurrent_map(resolve, jobs, workers))
+    # apps sharing a directory (bams and nucleo both link to bam_qc) are linked one after the other,
+    # in the order they were given, so the last one sets "current" as it would without --workers
+    groups = defaultdict(list)
+    for item in resolved:
+        (request, app, _), _, _ = item
+        groups[(request, FLAG_TO_APPS[app][1])].append(item)
+    linked = concurrent_map(lambda group: [link(item) for item in group], groups.values(), workers)
+    results = [result for group in linked for result in group]
+    print_summary(request_ids, results)
+
+
+def link_operator_run(operator_run, app, request, sample_id, arguments, config, show_all_runs):
+    (_, directory) = FLAG_TO_APPS[app]
+    if arguments.get('link'):
+        if arguments.get('--single-dir'):
+            if app == "bams":
+                link_bams_to_single_dir(operator_run, app, request, sample_id, arguments, config, show_all_runs)
+            else:
+                print("Apps other than bams not supported at this time")
+        else:
+            link_app(operator_run, directory, request, sample_id, arguments, config, show_all_runs)
+
+    if arguments.get('link-patient'):
+        if(app == "bams"):
+            link_bams_by_patient_id(operator_run, "bams", request, sample_id, arguments, config, show_all_runs)
+        else:
+            link_single_sample_workflows_by_patient_id(operator_run, directory, request, sample_id, arguments,
+                                                config, show_all_runs)
+
+
+def print_summary(request_ids, results):
+    by_request = defaultdict(list)
+    for (request, app, result) in results:
+        by_request[request].append("%s: %s" % (app, result))
+    failed = 0
+    print("Summary:", file=sys.stderr)
+    for request in request_ids:
+        request_results = by_request.get(request, [])
+        ok = all(result.endswith(": Linked") for result in request_results)
+        failed += not ok
+        print("%s\t%s\t%s" % (request, "OK" if ok else "FAILED", ", ".join(request_results)), file=sys.stderr)
+    print("%d of %d requests linked" % (len(request_ids) - failed, len(request_ids)), file=sys.stderr)
 
 def get_operator_run(app_name, app_version=None, tags=None, config=None, show_all_runs=False):
     latest_operator_run = {
@@ -60,15 +108,14 @@ def get_operator_run(app_name, app_version=None, tags=None, config=None, show_al
     if app_version:
         latest_operator_run["app_version"] = app_version
 
-    response = requests.get(urljoin(config['beagle_endpoint'], config['api']['operator-runs']),
-                            headers={'Authorization': 'Bearer %s' % config['token']},
-                            params=latest_operator_run)
+    response = config['client'].get(config['api']['operator-runs'], params=latest_operator_run)
+    response.raise_for_status()
 
     latest_runs = response.json()["results"]
     if not latest_runs:
         if "igoRequestId" in tags:
             new_tag = tags.replace("igoRequestId", "requestId")
-            return get_operator_run(app_name, app_version, tags=new_tag, config=config)
+            return get_operator_run(app_name, app_version, tags=new_tag, config=config, show_all_runs=show_all_runs)
         else:
             print("There are no completed operator runs for this request in the following app: %s:%s" %
                   (str(app_name), str(app_version)), file=sys.stderr)
@@ -82,9 +129,10 @@ def open_request_file(request_ids_file):
             request_ids = [] 
             for line in file:
                 # Remove leading and trailing whitespaces and split the line by comma
-                request = line.strip(',\n')
+                request = line.strip().strip(',')
                 # Append the list of items to the result list
-                request_ids.append(request)
+                if request:
+                    request_ids.append(request)
     except FileNotFoundError:
             raise FileNotFoundError('Cannot find filename')
     return request_ids
@@ -108,37 +156,6 @@ def get_arguments(arguments):
     return request_ids, sample_id, apps, show_all_runs
 
 
-def get_runs(operator_run_id, config, show_all_runs):
-    run_params = {
-        "operator_run": operator_run_id,
-        "page_size": 1000,
-        "status": "COMPLETED"
-    }
-
-    if show_all_runs:
-        run_params.pop("status")
-
-    response = requests.get(urljoin(config['beagle_endpoint'], config['api']['run']),
-                            headers={'Authorization': 'Bearer %s' % config['token']}, params=run_params)
-
-    return response.json()["results"]
-
-def get_run_by_id(run_id, config):
-    response = requests.get(urljoin(config['beagle_endpoint'], config['api']['run'] + run_id),
-                            headers={'Authorization': 'Bearer %s' % config['token']})
-
-    return response.json()
-
-
-def get_files_by_run_id(run_id, config):
-    response = requests.get(urljoin(config['beagle_endpoint'], config['api']['run'] + run_id),
-                            headers={'Authorization': 'Bearer %s' % config['token']})
-
-    return response.json()["outputs"]
-
-def get_file_path(file):
-    return file["location"][7:]
-
 def link_app(operator_run, directory, request_id, sample_id, arguments, config, show_all_runs):
     version = arguments.get("--dir-version") or operator_run["app_version"]
     should_delete = arguments.get("--delete") or False
@@ -146,35 +163,14 @@ def link_app(operator_run, directory, request_id, sample_id, arguments, config,
     path = Path("./")
     path_without_version = path / ("Project_" + request_id) / directory
     path = path_without_version / version
-    path.mkdir(parents=True, exist_ok=True, mode=0o755)
 
-    runs = get_runs(operator_run["id"], config, show_all_runs)
+    runs = get_run_details(operator_run, config, show_all_runs)
     if not runs:
         return
 
-    files = [] # (sample_id, /path/to/file)
-    for run_meta in runs:
-        run = get_run_by_id(run_meta["id"], config)
-        if should_delete:
-            try:
-                os.unlink(path / run["id"])
-                print((path / run["id"]).absolute(), file=sys.stdout)
-            except Exception as e:
-                print("could not delete symlink: {} ".format(path / run["id"]), file=sys.stderr)
-        else:
-            try:
-                os.symlink(run["output_directory"], path / run["id"])
-                print((path / run["id"]).absolute(), file=sys.stdout)
-            except Exception as e:
-                print("could not create symlink from '{}' to '{}'".format(run["output_directory"], path / run["id"]), file=sys.stderr)
-
-    try:
-        os.unlink(path_without_version / "current")
-    except:
-        pass
-
-    if not should_delete:
-        os.symlink(path.absolute(), path_without_version / "current")
+    links = {path / run["id"]: run["output_directory"] for run in runs}
+    links[path_without_version / "current"] = path.absolute()
+    reconcile_links(links, delete=should_delete, dry_run=arguments.get("--dry-run"))
     return "Completed"
 
 
@@ -184,12 +180,12 @@ def link_single_sample_workflows_by_patient_id(operator_run, directory, request_
 
     path = Path("./") / directory
 
-    runs = get_runs(operator_run["id"], config, show_all_runs)
+    runs = get_run_details(operator_run, config, show_all_runs)
     if not runs:
         return
 
-    for run_meta in runs:
-        run = get_run_by_id(run_meta["id"], config)
+    links = {}
+    for run in runs:
         if operator_run['app_name'] == 'access_manifest':
             sample_path = path / request_id
         else:
@@ -197,30 +193,11 @@ def link_single_sample_workflows_by_patient_id(operator_run, directory, request_
             a, b, _ = sample_id.split("-", 2)
             patient_id = "-".join([a, b])
             sample_path = path / patient_id / sample_id
-        sample_path.mkdir(parents=True, exist_ok=True, mode=0o755)
         sample_version_path = sample_path / version
+        links[sample_version_path] = run["output_directory"]
+        links[sample_path / "current"] = sample_version_path.absolute()
 
-        if should_delete:
-            try:
-                os.unlink(sample_version_path)
-                print(sample_version_path.absolute(), file=sys.stdout)
-            except Exception as e:
-                print("could not delete symlink: {} ".format(sample_version_path), file=sys.stderr)
-        else:
-            try:
-                os.symlink(run["output_directory"], sample_version_path)
-                print(sample_version_path.absolute(), file=sys.stdout)
-            except Exception as e:
-                print("could not create symlink from '{}' to '{}'".format(sample_version_path.absolute(), run["output_directory"]), file=sys.stderr)
-
-        try:
-            os.unlink(sample_path / "current")
-        except:
-            pass
-
-        if not should_delete:
-            os.symlink(sample_version_path.absolute(), sample_path / "current")
-
+    reconcile_links(links, delete=should_delete, dry_run=arguments.get("--dry-run"))
     return "Completed"
 
 def link_bams_to_single_dir(operator_run, directory, request_id, sample_id, arguments, config, show_all_runs):
@@ -228,53 +205,19 @@ def link_bams_to_single_dir(operator_run, directory, request_id, sample_id, argu
 
     path = Path("./") / directory / ("Project_" + request_id)
 
-    runs = get_runs(operator_run["id"], config, show_all_runs)
+    runs = get_run_details(operator_run, config, show_all_runs)
 
     if not runs:
         return
 
-    files = [] # (sample_id, /path/to/file)
-
-    for run in runs:
-        for file_group in get_files_by_run_id(run["id"], config):
-            files = files + find_files_by_sample(file_group["value"], sample_id=sample_id)
-
-    accepted_file_types = ['.bam', '.bai']
-    for (sample_id, file) in files:
-        file_path = get_file_path(file)
-        _, file_ext = os.path.splitext(file_path)
-
-        if file_ext not in accepted_file_types:
-            continue
-
-        file_name = os.path.basename(file_path)
-
-        sample_id, _ = file_name.split("_", 1)
-        a, b, _ = sample_id.split("-", 2)
-        patient_id = "-".join([a, b])
-
-
+    links = {}
+    for (sample_id, file_path, file_name) in find_bams(runs, sample_id):
         sample_path = path
         sample_version_path = sample_path / version
-        sample_version_path.mkdir(parents=True, exist_ok=True, mode=0o755)
-
-        try:
-            os.symlink(file_path, sample_version_path / file_name)
-            print((sample_version_path / file_name).absolute(), file=sys.stdout)
-        except Exception as e:
-            print("Could not create symlink from '{}' to '{}'".format(sample_version_path / file_name, file_path), file=sys.stderr)
-            continue
-
-        try:
-            os.unlink(sample_path / "current")
-        except Exception as e:
-            pass
-
-        try:
-            os.symlink(sample_version_path.absolute(), sample_path / "current")
-        except Exception as e:
-            pass
+        links[sample_version_path / file_name] = file_path
+        links[sample_path / "current"] = sample_version_path.absolute()
 
+    reconcile_links(links, dry_run=arguments.get("--dry-run"))
     return "Completed"
 
 def link_bams_by_patient_id(operator_run, directory, request_id, sample_id, arguments, config, show_all_runs):
@@ -283,92 +226,24 @@ def link_bams_by_patient_id(operator_run, directory, request_id, sample_id, argu
 
     path = Path("./") / directory
 
-    runs = get_runs(operator_run["id"], config, show_all_runs)
+    runs = get_run_details(operator_run, config, show_all_runs)
 
     if not runs:
         return
 
-    files = [] # (sample_id, /path/to/file)
-
-    for run in runs:
-        for file_group in get_files_by_run_id(run["id"], config):
-            files = files + find_files_by_sample(file_group["value"], sample_id=sample_id)
-
-    accepted_file_types = ['.bam', '.bai']
-    for (sample_id, file) in files:
-        file_path = get_file_path(file)
-        _, file_ext = os.path.splitext(file_path)
-
-        if file_ext not in accepted_file_types:
-            continue
-
-        file_name = os.path.basename(file_path)
-
-        sample_id, _ = file_name.split("_", 1)
+    links = {}
+    version_paths = set()
+    for (sample_id, file_path, file_name) in find_bams(runs, sample_id):
         a, b, _ = sample_id.split("-", 2)
         patient_id = "-".join([a, b])
 
-
         sample_path = path / patient_id / sample_id
         sample_version_path = sample_path / version
-        sample_version_path.mkdir(parents=True, exist_ok=True, mode=0o755)
-
-        if should_delete:
-            try:
-                shutil.rmtree(sample_version_path)
-                print(sample_version_path.absolute(), file=sys.stdout)
-            except Exception as e:
-                print("could not delete folder: {} ".format(sample_version_path), file=sys.stderr)
-        else:
-            try:
-                os.symlink(file_path, sample_version_path / file_name)
-                print((sample_version_path / file_name).absolute(), file=sys.stdout)
-            except Exception as e:
-                print("Could not create symlink from '{}' to '{}'".format(sample_version_path / file_name, file_path), file=sys.stderr)
-                continue
-
-        try:
-            os.unlink(sample_path / "current")
-        except Exception as e:
-            pass
-
-        if not should_delete:
-            try:
-                os.symlink(sample_version_path.absolute(), sample_path / "current")
-            except Exception as e:
-                pass
+        version_paths.add(sample_version_path)
+        links[sample_version_path / file_name] = file_path
+        links[sample_path / "current"] = sample_version_path.absolute()
 
+    # version directories emptied by --delete are removed as well
+    reconcile_links(links, delete=should_delete, dry_run=arguments.get("--dry-run"),
+                    prune_dirs=version_paths if should_delete else ())
     return "Completed"
-
-def find_files_by_sample(file_group, sample_id = None):
-    def traverse(file_group):
-        files = []
-        if not file_group:
-            return []
-        if type(file_group) == list:
-            if len(file_group) > 1:
-                return traverse(file_group[0]) + traverse(file_group[1:])
-            elif file_group:
-                return traverse(file_group[0])
-        elif "file" in file_group:
-            try:
-                file_sample_id = file_group["sampleId"]
-                if "File" == file_group["file"]["class"] and (not sample_id or
-                                                              file_sample_id ==
-                                                              sample_id):
-                    return [(file_sample_id, file_group["file"])] + [(file_sample_id,
-                                                                      f) for f in file_group["file"]["secondaryFiles"]]
-            except Exception as e:
-                print(e, file=sys.stderr)
-        elif "class" in file_group:
-            if file_group["class"] == "Directory":
-                return find_files_by_sample(file_group["listing"], sample_id=file_group["basename"])
-            # TODO pull patient id here
-            elif file_group["class"] == "File":
-                secondary_files = [(sample_id, f) for f in file_group["secondaryFiles"]] if "secondaryFiles" in file_group else []
-                return [(sample_id, file_group)] + secondary_files
-
-        return []
-
-    return traverse(file_group)
-
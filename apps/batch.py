@@ -0,0 +1,103 @@
+import contextvars
+import io
+import json
+import shlex
+import sys
+from contextlib import contextmanager
+
+from apps.client import concurrent_map, recording_failures
+
+
+class CapturedOutput(object):
+    """
+    Stand-in for sys.stdout that sends what is printed within capture() to its own
+    buffer, and everything else to the original stream. The buffer is held in a
+    context variable, so the worker threads concurrent_map starts within capture()
+    print to it as well.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = contextvars.ContextVar('buffer', default=None)
+
+    def _target(self):
+        return self.buffer.get() or self.stream
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @contextmanager
+    def capture(self):
+        buffer = io.StringIO()
+        token = self.buffer.set(buffer)
+        try:
+            yield buffer
+        finally:
+            self.buffer.reset(token)
+
+
+def read_operations(lines):
+    """
+    Yield (number, operation) for each JSONL line. An operation holds the command line
+    either as an "argv" list or as a "command" string, and an optional "id".
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            operation = json.loads(line)
+            if isinstance(operation, str):
+                operation = {'command': operation}
+            if 'argv' not in operation:
+                operation['argv'] = shlex.split(operation['command'])
+        except (ValueError, KeyError, TypeError) as e:
+            operation = {'argv': None, 'error': "Invalid operation: %s" % e}
+        yield number, operation
+
+
+def run_operations(operations, execute, workers=1, ordered=True):
+    """
+    Call execute(argv) for every operation on a pool of workers, yielding one result
+    dict per operation. Whatever an operation prints is captured into its result, and
+    an operation that received a 4xx or 5xx response is not ok.
+    """
+    output = CapturedOutput(sys.stdout)
+
+    def run(numbered_operation):
+        number, operation = numbered_operation
+        result = {'line': number, 'argv': operation.get('argv')}
+        if 'id' in operation:
+            result['id'] = operation['id']
+        if operation.get('error'):
+            return dict(result, ok=False, error=operation['error'])
+        with output.capture() as printed, recording_failures() as failures:
+            try:
+                value = execute(operation['argv'])
+            except SystemExit as e:
+                # docopt usage errors and commands that exit()
+                return dict(result, ok=False, error=str(e.code or "exited"), output=printed.getvalue())
+            except Exception as e:
+                return dict(result, ok=False, error="%s: %s" % (type(e).__name__, e), output=printed.getvalue())
+        if isinstance(value, str) and value.startswith("Error"):
+            return dict(result, ok=False, error=value, output=printed.getvalue())
+        try:
+            value = json.loads(value) if isinstance(value, str) else value
+        except ValueError:
+            pass
+        if failures:
+            return dict(result, ok=False, error="HTTP %d" % failures[-1], status_code=failures[-1], result=value,
+                        output=printed.getvalue())
+        return dict(result, ok=True, result=value, output=printed.getvalue())
+
+    sys.stdout = output
+    try:
+        yield from concurrent_map(run, operations, workers, ordered=ordered)
+    finally:
+        sys.stdout = output.stream
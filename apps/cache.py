@@ -0,0 +1,141 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from os.path import expanduser
+
+CACHE_DIR = os.environ.get('BEAGLE_CACHE_DIR', os.path.join(expanduser("~"), '.beagle_cache'))
+RUN_CACHE_ENABLED = os.environ.get('BEAGLE_RUN_CACHE', '').lower() in ('1', 'true', 'yes')
+RUN_CACHE_SIZE = int(os.environ.get('BEAGLE_RUN_CACHE_SIZE', 512)) * 1024 * 1024
+PIPELINE_CACHE_TTL = float(os.environ.get('BEAGLE_PIPELINE_CACHE_TTL', 3600))
+
+# Runs in these states never change again
+TERMINAL_STATES = ("COMPLETED",)
+
+
+class Cache(object):
+    """
+    SQLite store of zlib-compressed JSON documents.
+
+    Entries may carry an expiry, and the least recently used entries are
+    evicted once the compressed documents exceed max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        # the total size of the entries, kept up to date by triggers so set need not sum the table
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._db.executescript("""
+            BEGIN IMMEDIATE;
+            INSERT OR IGNORE INTO meta (key, value) SELECT 'size', COALESCE(SUM(size), 0) FROM entries;
+            CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+                UPDATE meta SET value = value + NEW.size WHERE key = 'size'; END;
+            CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+                UPDATE meta SET value = value + NEW.size - OLD.size WHERE key = 'size'; END;
+            CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                UPDATE meta SET value = value - OLD.size WHERE key = 'size'; END;
+            COMMIT;
+        """)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires <= now:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(value))
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+        expires = now + ttl if ttl is not None else None
+        with self._lock:
+            # an upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the trigger
+            self._db.execute("INSERT INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?) "
+                             "ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                             "expires = excluded.expires, accessed = excluded.accessed",
+                             (key, blob, len(blob), expires, now))
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+
+    def size(self):
+        """Return the total size of the compressed documents."""
+        return self._db.execute("SELECT value FROM meta WHERE key = 'size'").fetchone()[0]
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(name, max_bytes=None):
+    """Return the shared cache stored as name.sqlite in CACHE_DIR, or None when it cannot be opened."""
+    with _caches_lock:
+        if name not in _caches:
+            try:
+                _caches[name] = Cache(os.path.join(CACHE_DIR, name + '.sqlite'), max_bytes=max_bytes)
+            except (OSError, sqlite3.Error):
+                _caches[name] = None
+    return _caches[name]
+
+
+def run_cache():
+    """Return the cache of finished run documents, or None unless BEAGLE_RUN_CACHE is set."""
+    if not RUN_CACHE_ENABLED:
+        return None
+    return open_cache('runs', max_bytes=RUN_CACHE_SIZE)
+
+
+def get_cached_run(client, run_path, run_id, raise_for_status=False):
+    """
+    Fetch run_path + run_id, serving and storing runs in a terminal state through the run cache.
+    With raise_for_status a failed request raises HTTPError instead of returning the error body.
+    """
+    cache = run_cache()
+    key = "run:%s" % run_id
+    if cache:
+        run = cache.get(key)
+        if run is not None:
+            return run
+    response = client.get(run_path + run_id)
+    if raise_for_status:
+        response.raise_for_status()
+    run = response.json()
+    if cache and response.ok and run.get("status") in TERMINAL_STATES:
+        cache.set(key, run)
+    return run
@@ -1,10 +1,13 @@
+import csv
+import hashlib
 import json
-import pandas as pd 
-from collections import defaultdict
-from urllib.parse import urljoin
-from pathlib import Path
+import os
+import tempfile
+import textwrap
 import warnings
 
+from apps.writers import flatten
+
 C_NAMES = [
     "igoRequestId",
     "cmoSampleName",
@@ -36,57 +39,120 @@ C_NAMES = [
 ]
 
 
-def _clean_json(data, arguments):
-    force = arguments.get('--force')
-    # Iterating through the json
-    # list
-    # should do other check for format changes 
-    results = [] 
-    for i in range(0,len(data["results"])):
-        results.append(data['results'][i]['metadata']) 
-    df = pd.DataFrame(results)
-    # subset to important columns
-    # check all columns are present
-    if not set(C_NAMES).issubset(df.columns): 
-        missing_columns = set(C_NAMES) - set(df.columns)
-        present_columns = set(df.columns) - set(C_NAMES)
-        if force: 
-            # warn of missing 
+class MetadataPackager(object):
+    """
+    Package the metadata of files into <igoRequestId>.csv and <igoRequestId>.json.
+
+    Each record is reduced to the C_NAMES subset as it is added: lists are unwrapped to their first
+    item and nested dicts are expanded into their own columns. Rows are spooled to disk per request
+    and duplicates are dropped, so only the column names and row hashes are kept in memory.
+    """
+
+    def __init__(self, force=False, directory="."):
+        self.force = force
+        self.directory = directory
+        self.columns = {}  # C_NAMES column -> None, or the expanded keys of a dict column
+        self.spools = {}  # igoRequestId -> spool file
+        self.seen = set()
+
+    def add(self, metadata):
+        row = {}
+        for column in C_NAMES:
+            if column not in metadata:
+                continue
+            value = metadata[column]
+            if isinstance(value, list):
+                value = value[0] if value else None
+            if isinstance(value, dict):
+                value = flatten(value)
+                expanded = self.columns.get(column) or {}
+                expanded.update(dict.fromkeys(value))
+                self.columns[column] = expanded
+            else:
+                self.columns.setdefault(column, None)
+            row[column] = value
+        line = json.dumps(row, sort_keys=True)
+        request_id = str(row.get("igoRequestId"))
+        key = hashlib.sha1((request_id + "\t" + line).encode()).digest()
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        if request_id not in self.spools:
+            self.spools[request_id] = tempfile.TemporaryFile("w+")
+        self.spools[request_id].write(line + "\n")
+
+    def add_files(self, files):
+        for single_file in files:
+            self.add(single_file["metadata"])
+
+    def add_pages(self, pages):
+        """Add the files of each page, yielding the pages on as they are packaged."""
+        for page in pages:
+            self.add_files(page["results"])
+            yield page
+
+    def _output_columns(self):
+        missing_columns = set(C_NAMES) - set(self.columns)
+        if missing_columns:
+            if not self.force:
+                raise Exception('missing columns: {missing_columns} which are expect in file metadata. Metadata may be malformed, or format has changed in beagle. Use `--force` option if missing columns are acceptable.'.format(missing_columns = missing_columns))
+            # warn of missing
             warnings.warn('missing columns: {missing_columns}, which are expect in file metadata. Metadata may be malformed, or format has changed in beagle.'.format(missing_columns = missing_columns))
-            df = df[present_columns]
-        else:
-            raise Exception('missing columns: {missing_columns} which are expect in file metadata. Metadata may be malformed, or format has changed in beagle. Use `--force` option if missing columns are acceptable.'.format(missing_columns = missing_columns))
-    else: 
-        df = df[C_NAMES]
-    # normalize columns 
-    bf_list = [i for i in df.columns if isinstance(df[i][0],list)]
-    cleaned_columns = [df[column].apply(lambda x: x[0] if isinstance(x, list) else x) for column in bf_list]
-    df[bf_list] = pd.concat(cleaned_columns, axis=1)
-    bf_dict = [i for i in df.columns if isinstance(df[i][0],dict)]
-    normalized_columns = [pd.json_normalize(df[column]) for column in bf_dict]
-    normalized_df = pd.concat(normalized_columns, axis=1)
-    df = df.drop(columns=bf_dict)
-    df = pd.concat([df, normalized_df], axis=1)
-    df = df.drop_duplicates()
-    return df
-
-def _write_output(data, out_data):
-    # csv
-    out_name = data['results'][0]['metadata']['igoRequestId']
-    out_data = out_data.loc[:,~out_data.columns.duplicated()].copy()
-    out_data.to_csv('{out_name}.csv'.format(out_name=out_name), index=False)
-    # json 
-    out_data = out_data.to_dict('records')
-    with open('{out_name}.json'.format(out_name=out_name), 'w') as fout:
-        json.dump(out_data , fout, indent=4)
-
-
-
-def clean_json_comands(results, arguments):
-    # get args
-    datain=json.loads(results)
-    # clean json
-    dataout = _clean_json(datain, arguments)
-    # write out 
-    _write_output(datain, dataout)
-    
\ No newline at end of file
+        # plain columns first, then the columns expanded from dicts, keeping the first of duplicate names
+        columns = [(column, None) for column in C_NAMES if column in self.columns and self.columns[column] is None]
+        for column in C_NAMES:
+            for key in self.columns.get(column) or ():
+                columns.append((column, key))
+        names = {}
+        for column, key in columns:
+            names.setdefault(key or column, (column, key))
+        return names
+
+    def write(self):
+        """Write one CSV and one JSON file per igoRequestId and return their paths."""
+        try:
+            names = self._output_columns()
+            paths = []
+            for request_id, spool in self.spools.items():
+                spool.seek(0)
+                rows = (self._row(json.loads(line), names) for line in spool)
+                paths.extend(self._write_request(request_id, rows, list(names)))
+            return paths
+        finally:
+            self.close()
+
+    def _row(self, row, names):
+        values = {}
+        for name, (column, key) in names.items():
+            value = row.get(column)
+            if key is not None:
+                value = value.get(key) if isinstance(value, dict) else None
+            values[name] = value
+        return values
+
+    def _write_request(self, request_id, rows, names):
+        csv_path = os.path.join(self.directory, '{out_name}.csv'.format(out_name=request_id))
+        json_path = os.path.join(self.directory, '{out_name}.json'.format(out_name=request_id))
+        with open(csv_path, 'w', newline='') as csv_out, open(json_path, 'w') as json_out:
+            writer = csv.writer(csv_out, lineterminator='\n')
+            writer.writerow(names)
+            first_row = True
+            for row in rows:
+                writer.writerow([row[name] for name in names])
+                json_out.write('[\n' if first_row else ',\n')
+                json_out.write(textwrap.indent(json.dumps(row, indent=4), ' ' * 4))
+                first_row = False
+            json_out.write('[]' if first_row else '\n]')
+        return [csv_path, json_path]
+
+    def close(self):
+        for spool in self.spools.values():
+            spool.close()
+        self.spools = {}
+
+
+def package_files(files, force=False, directory="."):
+    """Package the metadata of files and return the paths written."""
+    packager = MetadataPackager(force, directory)
+    packager.add_files(files)
+    return packager.write()
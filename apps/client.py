@@ -0,0 +1,336 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from urllib.parse import parse_qsl, urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from apps.trace import ID_PATTERN, phase, record_retry, trace_response
+
+POOL_SIZE = int(os.environ.get('BEAGLE_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.environ.get('BEAGLE_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('BEAGLE_READ_TIMEOUT', 300))
+PAGE_SIZE = 1000
+
+# Retries of a failed request, waiting about BACKOFF * 2 ** attempt seconds (at most BACKOFF_MAX) in between
+RETRIES = int(os.environ.get('BEAGLE_RETRIES', 3))
+BACKOFF = float(os.environ.get('BEAGLE_BACKOFF', 0.5))
+BACKOFF_MAX = float(os.environ.get('BEAGLE_BACKOFF_MAX', 30))
+# Methods retried after any failure, other methods are only retried when the server did not get them
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Statuses of the failed responses received within recording_failures(), None outside of it
+FAILED_STATUSES = contextvars.ContextVar('failed_statuses', default=None)
+
+# Requests sent at once start at INITIAL_CONCURRENCY and adapt up to the pool size
+INITIAL_CONCURRENCY = 2
+# Responses slower than LATENCY_TOLERANCE times the fastest one seen for their endpoint and query
+# parameters shrink the limit by LATENCY_BACKOFF, once LATENCY_SAMPLES responses set that baseline.
+# 429 and 5xx responses and connection errors halve it
+LATENCY_TOLERANCE = 4.0
+LATENCY_BACKOFF = 0.9
+LATENCY_SAMPLES = 5
+
+
+def concurrent_map(fn, items, workers=POOL_SIZE, ordered=True):
+    """
+    Apply fn to every item on a pool of worker threads.
+
+    At most 2 * workers calls are in flight, so items may be a lazy iterable of
+    any length. Results are yielded in input order, or as soon as they complete
+    when ordered is False. Each call runs in a copy of the caller's context, so
+    context variables such as a batch operation's captured output carry over.
+    """
+    items = iter(items)
+
+    def submit(item):
+        return executor.submit(contextvars.copy_context().run, fn, item)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque(submit(item) for item in islice(items, workers * 2))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [future for future in pending if future in finished]
+                pending = deque(future for future in pending if future not in finished)
+            for future in done:
+                pending.extend(submit(item) for item in islice(items, 1))
+                yield future.result()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to every request."""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class AdaptiveLimit(object):
+    """
+    Limit on the requests in flight, adjusted AIMD-style from how each one went.
+
+    The limit grows by one per request until the first sign of congestion (slow start),
+    then by one per limit's worth of requests, and only while it is actually reached.
+    It shrinks on 429 and 5xx responses, connection errors and slow responses. Only
+    requests sent after the last decrease can shrink it again, so a burst of failures
+    of requests sent together counts once.
+    """
+
+    def __init__(self, maximum, initial=INITIAL_CONCURRENCY):
+        self.maximum = maximum
+        self.limit = float(max(1, min(initial, maximum)))
+        self.in_flight = 0
+        self.slow_start = True
+        self.decreased_at = 0.0
+        self.min_latency = {}  # endpoint -> (responses, fastest response in seconds)
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot and return the time the request is sent."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, sent, endpoint, latency=None, congested=False):
+        with self.condition:
+            limited = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            factor = 0.5 if congested else None
+            if latency is not None and not congested:
+                responses, fastest = self.min_latency.get(endpoint, (0, latency))
+                if responses >= LATENCY_SAMPLES and latency > LATENCY_TOLERANCE * max(fastest, 0.001):
+                    factor = LATENCY_BACKOFF
+                self.min_latency[endpoint] = (responses + 1, min(fastest, latency))
+            if factor is not None:
+                if sent >= self.decreased_at:
+                    self.limit = max(1.0, self.limit * factor)
+                    self.slow_start = False
+                    self.decreased_at = time.monotonic()
+            elif limited:
+                self.limit = min(float(self.maximum), self.limit + (1 if self.slow_start else 1 / self.limit))
+            self.condition.notify_all()
+
+
+class AdaptiveHTTPAdapter(TimeoutHTTPAdapter):
+    """
+    TimeoutHTTPAdapter that retries failed requests with jittered exponential backoff and
+    keeps the requests in flight under an AdaptiveLimit shared by every thread of the session.
+    Idempotent requests are retried after connection errors, timeouts and RETRY_STATUSES,
+    other requests only after a 429 or a connect timeout.
+    """
+
+    def __init__(self, timeout=None, retries=RETRIES, pool_maxsize=POOL_SIZE, **kwargs):
+        self.retries = retries
+        self.limit = AdaptiveLimit(pool_maxsize)
+        super().__init__(timeout=timeout, pool_maxsize=pool_maxsize, **kwargs)
+
+    def send(self, request, **kwargs):
+        endpoint = _endpoint(request)
+        idempotent = request.method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            sent = self.limit.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.limit.release(sent, endpoint, congested=True)
+                retry = idempotent or isinstance(e, requests.ConnectTimeout)
+                if attempt >= self.retries or not retry:
+                    raise
+                delay = _backoff(attempt)
+            else:
+                status = response.status_code
+                # response.elapsed is only set once the session gets the response back from the adapter
+                self.limit.release(sent, endpoint, time.monotonic() - sent, status in RETRY_STATUSES)
+                retry = status in RETRY_STATUSES if idempotent else status == 429
+                if attempt >= self.retries or not retry:
+                    return response
+                delay = max(_backoff(attempt), _retry_after(response))
+                _discard(response)
+            record_retry(request.method, request.url)
+            time.sleep(delay)
+            attempt += 1
+
+
+def _endpoint(request):
+    """
+    Return the method, path and query parameter names of request, so that the latency of a
+    count=True probe or a lookup by id is not compared with the pages of the same list.
+    """
+    url = urlparse(request.url)
+    query = ",".join(sorted({name for name, _ in parse_qsl(url.query, keep_blank_values=True)}))
+    return "%s %s?%s" % (request.method, ID_PATTERN.sub('/<id>', url.path), query)
+
+
+def _backoff(attempt):
+    """Half of the exponential delay plus a random part of the other half, so retries spread out."""
+    delay = min(BACKOFF_MAX, BACKOFF * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _discard(response):
+    """Read the body of a response that will be retried, so its connection goes back to the pool."""
+    try:
+        response.content
+        response.raw.release_conn()
+    except (requests.RequestException, OSError):
+        response.close()
+
+
+def _retry_after(response):
+    try:
+        return min(BACKOFF_MAX, float(response.headers.get('Retry-After', 0)))
+    except ValueError:
+        # HTTP dates are not worth parsing here
+        return 0
+
+
+def record_failure(response, *args, **kwargs):
+    """Response hook noting 4xx and 5xx responses for recording_failures()."""
+    failures = FAILED_STATUSES.get()
+    if failures is not None and response.status_code >= 400:
+        failures.append(response.status_code)
+
+
+@contextmanager
+def recording_failures():
+    """
+    Collect the status of every 4xx and 5xx response the block receives, retries
+    aside, including those received by the worker threads of concurrent_map.
+    """
+    failures = []
+    token = FAILED_STATUSES.set(failures)
+    try:
+        yield failures
+    finally:
+        FAILED_STATUSES.reset(token)
+
+
+def create_session(pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), auth=None, verify=True):
+    """
+    Create a keep-alive session holding up to pool_size connections per host, that retries
+    failed requests and adapts how many of them are sent at once.
+    """
+    session = requests.Session()
+    adapter = AdaptiveHTTPAdapter(timeout=timeout, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.auth = auth
+    session.verify = verify
+    session.hooks['response'].extend([trace_response, record_failure])
+    return session
+
+
+class BeagleClient(object):
+    """
+    Pooled HTTP client for the Beagle API.
+
+    Paths are resolved against the endpoint the same way urljoin is used
+    throughout the CLI, and the Bearer header is injected once per token
+    instead of being rebuilt for every call.
+    """
+
+    def __init__(self, endpoint, token=None, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.endpoint = endpoint
+        self.session = create_session(pool_size=pool_size, timeout=timeout)
+        self.token = token
+
+    @property
+    def token(self):
+        return self._token
+
+    @token.setter
+    def token(self, token):
+        self._token = token
+        if token:
+            self.session.headers['Authorization'] = 'Bearer %s' % token
+        else:
+            self.session.headers.pop('Authorization', None)
+
+    def url(self, path):
+        return urljoin(self.endpoint, path)
+
+    def request(self, method, path, **kwargs):
+        return self.session.request(method, self.url(path), **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, data=None, **kwargs):
+        return self.request('POST', path, data=data, **kwargs)
+
+    def put(self, path, data=None, **kwargs):
+        return self.request('PUT', path, data=data, **kwargs)
+
+    def patch(self, path, data=None, **kwargs):
+        return self.request('PATCH', path, data=data, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def iter_pages(self, path, params=None, page_size=PAGE_SIZE, workers=1):
+        """
+        Yield each page of a paginated list endpoint, following next links.
+
+        With more than one worker the total is counted first and pages are
+        fetched concurrently by page number, then yielded in order.
+        """
+        if workers > 1:
+            yield from self._iter_pages_parallel(path, params, int(page_size), workers)
+            return
+        params = dict(params or {})
+        params['page_size'] = page_size
+        url = path
+        while url:
+            with phase('pagination'):
+                response = self.get(url, params=params)
+                response.raise_for_status()
+                with phase('decode'):
+                    page = response.json()
+            yield page
+            url = page.get('next')
+            # The next link already carries the query string
+            params = None
+
+    def _iter_pages_parallel(self, path, params, page_size, workers):
+        params = dict(params or {})
+        response = self.get(path, params=dict(params, count=True))
+        response.raise_for_status()
+        count = response.json()['count']
+        page_count = max(1, -(-count // page_size))
+
+        def fetch(page_number):
+            with phase('pagination'):
+                response = self.get(path, params=dict(params, page_size=page_size, page=page_number))
+                response.raise_for_status()
+                with phase('decode'):
+                    return response.json()
+
+        yield from concurrent_map(fetch, range(1, page_count + 1), workers)
+
+    def paginate(self, path, params=None, page_size=PAGE_SIZE, workers=1):
+        """Yield every record of a paginated list endpoint, a bounded number of pages in memory at a time."""
+        for page in self.iter_pages(path, params, page_size, workers):
+            for result in page['results']:
+                yield result
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,168 @@
+import hashlib
+import io
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from os.path import expanduser
+
+DAEMON_SOCKET = os.environ.get('BEAGLE_SOCKET', os.path.join(expanduser("~"), '.beagle.sock'))
+
+# Frames sent back to the client: a channel byte and a length, then the data
+FRAME_HEADER = struct.Struct('!cI')
+STDOUT, STDERR, EXIT, REFUSED = b'o', b'e', b'x', b'r'
+
+# Variables configuring what commands do, which the daemon and its clients must share
+SETTINGS_PREFIXES = ('BEAGLE_', 'LIMS_')
+# Variables that only decide whether and how a command is forwarded
+CLIENT_VARIABLES = ('BEAGLE_DAEMON', 'BEAGLE_SOCKET', 'BEAGLE_TRACE')
+
+
+class FrameWriter(io.RawIOBase):
+    """Binary stream that sends everything written to it as frames of one channel."""
+
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        _send_frame(self.connection, self.channel, bytes(data))
+        return len(data)
+
+
+def _send_frame(connection, channel, data):
+    connection.write(FRAME_HEADER.pack(channel, len(data)) + data)
+    connection.flush()
+
+
+def _text_stream(connection, channel):
+    return io.TextIOWrapper(io.BufferedWriter(FrameWriter(connection, channel)), encoding='utf-8',
+                            line_buffering=True)
+
+
+def settings(environ=None):
+    """Return a digest of the BEAGLE_ and LIMS_ variables and HOME, so that they are compared but not sent."""
+    environ = os.environ if environ is None else environ
+    variables = sorted((name, value) for name, value in environ.items()
+                       if (name.startswith(SETTINGS_PREFIXES) or name == 'HOME') and name not in CLIENT_VARIABLES)
+    return hashlib.sha256(json.dumps(variables).encode()).hexdigest()
+
+
+def serve(path, execute, daemon_settings):
+    """
+    Run the commands thin clients send over a Unix socket until interrupted. Commands run one
+    at a time in the working directory of the client and their output is streamed back to it.
+    Clients whose settings differ from daemon_settings are refused and run the command themselves.
+    Commands get an empty stdin, so that anything prompting fails instead of waiting on the daemon.
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                # ping
+                return
+            request = json.loads(line)
+            if request.get('settings') != daemon_settings:
+                _send_frame(self.wfile, REFUSED, b"")
+                return
+            stdout, stderr = _text_stream(self.wfile, STDOUT), _text_stream(self.wfile, STDERR)
+            status = 0
+            cwd = os.getcwd()
+            stdin = sys.stdin
+            try:
+                os.chdir(request['cwd'])
+                sys.stdin = io.StringIO()
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    try:
+                        result = execute(request['argv'])
+                        if result is not None:
+                            print(result)
+                    except SystemExit as e:
+                        if isinstance(e.code, str):
+                            print(e.code, file=sys.stderr)
+                            status = 1
+                        else:
+                            status = e.code or 0
+                    except Exception as e:
+                        print("%s: %s" % (type(e).__name__, e), file=sys.stderr)
+                        status = 1
+                    finally:
+                        stdout.flush()
+                        stderr.flush()
+                _send_frame(self.wfile, EXIT, str(status).encode())
+            except (BrokenPipeError, ConnectionResetError):
+                print("Client disconnected during: %s" % " ".join(request['argv']), file=sys.stderr)
+            finally:
+                sys.stdin = stdin
+                os.chdir(cwd)
+
+    if os.path.exists(path):
+        if ping(path):
+            raise SystemExit("A beaglecli daemon is already listening on %s" % path)
+        os.unlink(path)
+    server = socketserver.UnixStreamServer(path, Handler)
+    os.chmod(path, 0o600)
+    print("Listening on %s" % path, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def ping(path):
+    """Return whether a daemon accepts connections on path."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def forward(path, argv, client_settings):
+    """
+    Send argv to the daemon listening on path and replay its output as it arrives. Returns the exit
+    status, or None when no daemon is listening or it refused the command, so it can run locally.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+    request = {'argv': argv, 'cwd': os.getcwd(), 'settings': client_settings}
+    with client, client.makefile('rwb') as connection:
+        connection.write(json.dumps(request).encode() + b"\n")
+        connection.flush()
+        while True:
+            header = connection.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                print("The beaglecli daemon closed the connection", file=sys.stderr)
+                return 1
+            channel, length = FRAME_HEADER.unpack(header)
+            data = connection.read(length)
+            if channel == STDOUT:
+                sys.stdout.buffer.write(data)
+                sys.stdout.buffer.flush()
+            elif channel == STDERR:
+                sys.stderr.buffer.write(data)
+                sys.stderr.buffer.flush()
+            elif channel == EXIT:
+                return int(data)
+            else:
+                print("The beaglecli daemon on %s runs with other BEAGLE_ or LIMS_ variables, running here" % path,
+                      file=sys.stderr)
+                return None
@@ -1,56 +1,149 @@
 import json
 import os
-import uuid
-import argparse
-import re
-import requests
+import sys
 from requests.auth import HTTPBasicAuth
 
-LIMS_URL = "https://igolims.mskcc.org:8443/LimsRest/api"
+from apps.cache import open_cache
+from apps.client import concurrent_map, create_session
+
+LIMS_URL = os.environ.get('LIMS_URL', "https://igolims.mskcc.org:8443/LimsRest/api")
 LIMS_USER = os.environ.get('LIMS_USER', '')
 LIMS_PASS = os.environ.get('LIMS_PASS', '')
 LIMS_AUTH = HTTPBasicAuth(LIMS_USER, LIMS_PASS)
+LIMS_SESSION = create_session(auth=LIMS_AUTH, verify=False)
+CHUNK_SIZE = 10
+LIMS_CACHE_ENABLED = os.environ.get('LIMS_CACHE', '').lower() in ('1', 'true', 'yes')
+# Seconds LIMS responses are kept in the local cache, 0 disables it
+LIMS_CACHE_TTL = float(os.environ.get('LIMS_CACHE_TTL', 3600))
+# Megabytes of LIMS responses kept before the least recently used are evicted
+LIMS_CACHE_SIZE = int(os.environ.get('LIMS_CACHE_SIZE', 64)) * 1024 * 1024
 
 def lims_commands(arguments, config):
-    print(LIMS_USER)
+    print(LIMS_USER, file=sys.stderr)
     if arguments.get('metadata'):
-        process_requests(arguments.get('--request-id'))
+        chunk_size = int(arguments.get('--chunk-size') or CHUNK_SIZE)
+        workers = int(arguments.get('--workers') or 1)
+        process_requests(arguments.get('--request-id'), chunk_size, workers, arguments.get('--ndjson'),
+                         use_cache=not arguments.get('--no-cache'))
+
+def lims_cache():
+    """Return the cache of LIMS responses, or None unless LIMS_CACHE is set."""
+    return open_cache('lims', max_bytes=LIMS_CACHE_SIZE) if LIMS_CACHE_ENABLED and LIMS_CACHE_TTL > 0 else None
+
+def cache_key(kind, key):
+    # responses of different LimsRest servers are kept apart
+    return "%s:%s:%s" % (LIMS_URL, kind, key)
 
-def get_samples_from_request(request_id):
-    response = requests.get("%s/getRequestSamples?request=%s" % (LIMS_URL, request_id), auth=LIMS_AUTH,
-                            verify=False)
+def get_samples_from_request(request_id, use_cache=True):
+    cache = lims_cache()
+    if cache and use_cache:
+        sample_ids = cache.get(cache_key("request-samples", request_id))
+        if sample_ids is not None:
+            return sample_ids
+    response = LIMS_SESSION.get("%s/getRequestSamples" % LIMS_URL, params={"request": request_id})
+    response.raise_for_status()
     results = response.json()
     if "error" in results:
-        print(request_id, results, response.url)
+        print(request_id, results, response.url, file=sys.stderr)
         exit()
-    return [sample["igoSampleId"] for sample in results["samples"]]
+    sample_ids = [sample["igoSampleId"] for sample in results["samples"]]
+    if cache:
+        cache.set(cache_key("request-samples", request_id), sample_ids, ttl=LIMS_CACHE_TTL)
+    return sample_ids
 
 def chunks(lst, n):
     """Yield successive n-sized chunks from lst."""
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
-def get_cmo_to_metadata(sample_ids):
+def get_sample_manifests(sample_ids, use_cache=True):
+    """
+    Return the manifests of sample_ids in order. Cached manifests are reused and only
+    the samples missing from the cache are requested from LIMS.
+    """
+    cache = lims_cache()
+    cached = {}
+    if cache and use_cache:
+        for sample_id in sample_ids:
+            manifests = cache.get(cache_key("manifest", sample_id))
+            if manifests is not None:
+                cached[sample_id] = manifests
+    missing = [sample_id for sample_id in sample_ids if sample_id not in cached]
+    if not missing:
+        return [manifest for sample_id in sample_ids for manifest in cached[sample_id]]
+    params = [("igoSampleId", sample_id) for sample_id in missing]
+    response = LIMS_SESSION.get("%s/getSampleManifest" % LIMS_URL, params=params)
+    response.raise_for_status()
+    results = response.json()
+    by_sample = {}
+    for result in results:
+        by_sample.setdefault(result.get("igoId"), []).append(result)
+    if cache:
+        for sample_id in missing:
+            if sample_id in by_sample:
+                cache.set(cache_key("manifest", sample_id), by_sample[sample_id], ttl=LIMS_CACHE_TTL)
+    if not cached:
+        return results
+    manifests = []
+    for sample_id in sample_ids:
+        manifests.extend(cached[sample_id] if sample_id in cached else by_sample.pop(sample_id, []))
+    # manifests that do not match a requested sample are kept at the end
+    for unmatched in by_sample.values():
+        manifests.extend(unmatched)
+    return manifests
+
+def get_cmo_to_metadata(sample_ids, chunk_size=CHUNK_SIZE, workers=1):
     ret = []
-    for sample_id_group in list(chunks(sample_ids, 10)):
-        params = map(lambda sid: "igoSampleId=%s" % sid, sample_id_group)
-        params = "&".join(params)
-        response = requests.get("%s/getSampleManifest?%s" % (LIMS_URL, params),
-                                auth=LIMS_AUTH, verify=False)
-        results = response.json()
-        for result in results:
-            ret.append(result)
+    for results in concurrent_map(get_sample_manifests, chunks(sample_ids, chunk_size), workers):
+        ret.extend(results)
     return ret
 
-def process_request(request_id):
+def process_request(request_id, chunk_size=CHUNK_SIZE, workers=1):
     sample_ids = get_samples_from_request(request_id)
-    request_cmo_ids = get_cmo_to_metadata(sample_ids)
+    request_cmo_ids = get_cmo_to_metadata(sample_ids, chunk_size, workers)
     return request_cmo_ids
 
-def process_requests(request_ids):
-    ret = []
-    for p in request_ids:
-        ret = ret + process_request(p)
+def iter_manifests(request_ids, chunk_size=CHUNK_SIZE, workers=1, use_cache=True):
+    """
+    Yield (request_id, manifests) for every chunk of samples, in request order. Chunks of all
+    requests share one pool of workers, so a bounded number of them is held at a time.
+    """
+    def sample_chunks():
+        requests = concurrent_map(lambda request_id: (request_id, get_samples_from_request(request_id, use_cache)),
+                                  request_ids, workers)
+        for request_id, sample_ids in requests:
+            if not sample_ids:
+                yield request_id, []
+            for sample_id_group in chunks(sample_ids, chunk_size):
+                yield request_id, sample_id_group
 
-    print(json.dumps(ret))
+    def fetch(chunk):
+        request_id, sample_ids = chunk
+        return request_id, get_sample_manifests(sample_ids, use_cache) if sample_ids else []
 
+    yield from concurrent_map(fetch, sample_chunks(), workers)
+
+def process_requests(request_ids, chunk_size=CHUNK_SIZE, workers=1, ndjson=False, use_cache=True):
+    """
+    Print the manifests as they arrive, either as one JSON list or with ndjson
+    as one {"requestId", "samples"} line per request.
+    """
+    first = True
+    current_request, samples = None, []
+    for request_id, results in iter_manifests(request_ids, chunk_size, workers, use_cache):
+        if ndjson:
+            if request_id != current_request and current_request is not None:
+                print(json.dumps({"requestId": current_request, "samples": samples}), flush=True)
+                samples = []
+            current_request = request_id
+            samples.extend(results)
+            continue
+        for result in results:
+            sys.stdout.write("[" if first else ", ")
+            sys.stdout.write(json.dumps(result))
+            first = False
+    if ndjson:
+        if current_request is not None:
+            print(json.dumps({"requestId": current_request, "samples": samples}))
+    else:
+        sys.stdout.write("[]\n" if first else "]\n")
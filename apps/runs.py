@@ -0,0 +1,97 @@
+import os
+import sys
+
+from apps.cache import TERMINAL_STATES, get_cached_run, run_cache
+from apps.client import POOL_SIZE, concurrent_map
+from apps.trace import phase
+
+# Keys a run from the run list must carry to be used without fetching it by id
+RUN_DETAIL_KEYS = ("output_directory", "outputs", "tags")
+
+
+def get_runs(operator_run_id, config, show_all_runs):
+    run_params = {
+        "operator_run": operator_run_id,
+        "full": True,
+        "status": "COMPLETED"
+    }
+
+    if show_all_runs:
+        run_params.pop("status")
+
+    return list(config['client'].paginate(config['api']['run'], params=run_params, page_size=1000))
+
+
+def get_run_by_id(run_id, config):
+    return get_cached_run(config['client'], config['api']['run'], run_id, raise_for_status=True)
+
+
+def get_run_details(operator_run, config, show_all_runs):
+    """
+    Return the full document of every run of an operator run. The list response is used as is when it
+    already carries the run details, otherwise each run is fetched once on a pool of workers.
+    The runs of a completed operator run are kept in the run cache when it is enabled.
+    """
+    cache = run_cache()
+    cache_key = "operator-run:%s:%s" % (operator_run["id"], "all" if show_all_runs else "completed")
+    finished = cache is not None and operator_run.get("status") in TERMINAL_STATES
+    if finished:
+        runs = cache.get(cache_key)
+        if runs is not None:
+            return runs
+    with phase('traversal'):
+        runs = get_runs(operator_run["id"], config, show_all_runs)
+        if not all(key in run for run in runs for key in RUN_DETAIL_KEYS):
+            workers = config.get('workers') or POOL_SIZE
+            runs = list(concurrent_map(lambda run: get_run_by_id(run["id"], config), runs, workers))
+    if finished and all(run.get("status") in TERMINAL_STATES for run in runs):
+        cache.set(cache_key, runs)
+    return runs
+
+
+def get_file_path(file):
+    return file["location"][7:]
+
+
+def find_bams(runs, sample_id=None):
+    """Yield (sample_id, file_path, file_name) for every bam/bai in the outputs of runs."""
+    accepted_file_types = ['.bam', '.bai']
+    for run in runs:
+        for file_group in run["outputs"]:
+            for (_, file) in find_files_by_sample(file_group["value"], sample_id=sample_id):
+                file_path = get_file_path(file)
+                _, file_ext = os.path.splitext(file_path)
+
+                if file_ext not in accepted_file_types:
+                    continue
+
+                file_name = os.path.basename(file_path)
+                file_sample_id, _ = file_name.split("_", 1)
+                yield file_sample_id, file_path, file_name
+
+
+def find_files_by_sample(file_group, sample_id=None):
+    """Yield (sample_id, file) for every File in a nested CWL output value, in document order."""
+    stack = [(file_group, sample_id)]
+    while stack:
+        node, node_sample_id = stack.pop()
+        if not node:
+            continue
+        if type(node) == list:
+            stack.extend((item, node_sample_id) for item in reversed(node))
+        elif "file" in node:
+            try:
+                file_sample_id = node["sampleId"]
+                if "File" == node["file"]["class"] and (not node_sample_id or file_sample_id == node_sample_id):
+                    files = [(file_sample_id, node["file"])] + [(file_sample_id, f) for f in node["file"]["secondaryFiles"]]
+                    yield from files
+            except Exception as e:
+                print(e, file=sys.stderr)
+        elif "class" in node:
+            if node["class"] == "Directory":
+                stack.append((node["listing"], node["basename"]))
+            # TODO pull patient id here
+            elif node["class"] == "File":
+                yield (node_sample_id, node)
+                for f in node.get("secondaryFiles", []):
+                    yield (node_sample_id, f)
@@ -0,0 +1,144 @@
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+from apps.trace import phase
+
+# directory -> lock held while its links are planned and applied
+DIRECTORY_LOCKS = {}
+DIRECTORY_LOCKS_LOCK = threading.Lock()
+
+
+class LinkPlan(object):
+    """Changes needed to bring a set of symlinks to their desired targets."""
+
+    def __init__(self, missing_dirs):
+        self.create = []  # (link, target)
+        self.update = []  # (link, target, current target)
+        self.delete = []  # (link, current target)
+        self.conflicts = []  # links that exist but are not symlinks
+        self.unchanged = 0
+        self.missing_dirs = missing_dirs
+
+    def summary(self):
+        return "Links: %d created, %d updated, %d deleted, %d unchanged, %d conflicts" % (
+            len(self.create), len(self.update), len(self.delete), self.unchanged, len(self.conflicts))
+
+
+def _scan(directories, wanted):
+    """List each directory once and read the target of every symlink in wanted."""
+    existing = {}  # link -> target, or None when the entry is not a symlink
+    missing_dirs = set()
+    for directory in directories:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.path in wanted:
+                        existing[entry.path] = os.readlink(entry.path) if entry.is_symlink() else None
+        except FileNotFoundError:
+            missing_dirs.add(directory)
+    return existing, missing_dirs
+
+
+def plan_links(links, delete=False):
+    """
+    Compare the desired {link: target} map with what is on disk, listing each parent
+    directory once. With delete, every existing link in the map is planned for removal.
+    """
+    links = {str(link): str(target) for link, target in links.items()}
+    existing, missing_dirs = _scan({os.path.dirname(link) for link in links}, links)
+    plan = LinkPlan(missing_dirs)
+    for link, target in links.items():
+        if link not in existing:
+            if not delete:
+                plan.create.append((link, target))
+        elif existing[link] is None:
+            plan.conflicts.append(link)
+        elif delete:
+            plan.delete.append((link, existing[link]))
+        elif existing[link] == target:
+            plan.unchanged += 1
+        else:
+            plan.update.append((link, target, existing[link]))
+    return plan
+
+
+def print_plan(plan):
+    for link, target in plan.create:
+        print("create {} -> {}".format(link, target))
+    for link, target, current in plan.update:
+        print("update {} -> {} (was {})".format(link, target, current))
+    for link, current in plan.delete:
+        print("delete {} (was {})".format(link, current))
+    for link in plan.conflicts:
+        print("skip {} (not a symlink)".format(link))
+
+
+def apply_plan(plan, prune_dirs=()):
+    created_dirs = set()
+    for link, target in plan.create:
+        directory = os.path.dirname(link)
+        if directory in plan.missing_dirs and directory not in created_dirs:
+            os.makedirs(directory, mode=0o755, exist_ok=True)
+            created_dirs.add(directory)
+        try:
+            os.symlink(target, link)
+            print(os.path.abspath(link), file=sys.stdout)
+        except OSError as e:
+            print("could not create symlink from '{}' to '{}': {}".format(link, target, e), file=sys.stderr)
+    for link, target, _ in plan.update:
+        # swap the link in one rename so it never disappears
+        tmp_link = "%s.tmp-%d-%d" % (link, os.getpid(), threading.get_ident())
+        try:
+            os.symlink(target, tmp_link)
+            os.replace(tmp_link, link)
+            print(os.path.abspath(link), file=sys.stdout)
+        except OSError as e:
+            print("could not update symlink from '{}' to '{}': {}".format(link, target, e), file=sys.stderr)
+    for link, _ in plan.delete:
+        try:
+            os.unlink(link)
+            print(os.path.abspath(link), file=sys.stdout)
+        except OSError as e:
+            print("could not delete symlink: {} ({})".format(link, e), file=sys.stderr)
+    for link in plan.conflicts:
+        print("{} exists and is not a symlink, leaving it in place".format(link), file=sys.stderr)
+    for directory in prune_dirs:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+
+@contextmanager
+def _locked(directories):
+    """
+    Hold the lock of every directory, so that threads linking into the same directories
+    (a patient tree shared by two requests) do not plan against each other's changes.
+    """
+    with DIRECTORY_LOCKS_LOCK:
+        # always taken in the same order, so two threads cannot wait on each other
+        locks = [DIRECTORY_LOCKS.setdefault(directory, threading.Lock()) for directory in sorted(directories)]
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+def reconcile_links(links, delete=False, dry_run=False, prune_dirs=()):
+    """
+    Create, retarget or (with delete) remove only the symlinks that differ from the
+    desired {link: target} map. With dry_run the plan is printed instead of applied.
+    """
+    with phase('linking'), _locked({os.path.abspath(os.path.dirname(str(link))) for link in links}):
+        plan = plan_links(links, delete)
+        if dry_run:
+            print_plan(plan)
+        else:
+            apply_plan(plan, prune_dirs)
+    print(plan.summary(), file=sys.stderr)
+    return plan
@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+# The active Tracer, None unless tracing was enabled
+TRACER = None
+
+# Ids in URL paths, replaced so that calls to the same endpoint are summarized together
+ID_PATTERN = re.compile(r'/(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d+)(?=/|$)', re.I)
+
+# Functions listed by --profile without a file
+PROFILE_LINES = 40
+
+
+class Tracer(object):
+    """Records HTTP calls and phases with their start time, duration and thread."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.calls = []
+        self.phases = []
+        self.retries = {}  # endpoint -> retried calls
+
+    def record_call(self, method, url, status, start, duration, latency, size, retries=0):
+        call = {
+            'endpoint': "%s %s" % (method, ID_PATTERN.sub('/<id>', urlparse(url).path)),
+            'url': url,
+            'status': status,
+            'start': start - self.start,
+            'duration': duration,
+            'latency': latency,
+            'bytes': size,
+            'retries': retries,
+            'thread': threading.get_ident(),
+        }
+        with self.lock:
+            self.calls.append(call)
+
+    def record_retry(self, method, url):
+        endpoint = "%s %s" % (method, ID_PATTERN.sub('/<id>', urlparse(url).path))
+        with self.lock:
+            self.retries[endpoint] = self.retries.get(endpoint, 0) + 1
+
+    def record_phase(self, name, start, duration):
+        with self.lock:
+            self.phases.append({'name': name, 'start': start - self.start, 'duration': duration,
+                                'thread': threading.get_ident()})
+
+    def summary(self):
+        """Return the calls per endpoint and the time spent in each phase as text tables."""
+        endpoints = {}
+        for call in self.calls:
+            endpoints.setdefault(call['endpoint'], []).append(call)
+        lines = ["%-48s %6s %6s %7s %9s %9s %9s %9s %12s" % (
+            "endpoint", "calls", "errors", "retries", "total s", "mean ms", "p95 ms", "max ms", "bytes")]
+        for endpoint, calls in sorted(endpoints.items(), key=lambda item: -sum(c['duration'] for c in item[1])):
+            durations = sorted(call['duration'] for call in calls)
+            total = sum(durations)
+            lines.append("%-48s %6d %6d %7d %9.3f %9.1f %9.1f %9.1f %12d" % (
+                endpoint, len(calls), sum(1 for call in calls if call['status'] >= 400),
+                sum(call['retries'] for call in calls) + self.retries.get(endpoint, 0), total,
+                1000 * total / len(calls), 1000 * durations[max(0, math.ceil(0.95 * len(durations)) - 1)],
+                1000 * durations[-1], sum(call['bytes'] for call in calls)))
+        phases = {}
+        for phase in self.phases:
+            count, total = phases.get(phase['name'], (0, 0.0))
+            phases[phase['name']] = (count + 1, total + phase['duration'])
+        lines.append("")
+        lines.append("%-48s %6s %9s" % ("phase", "count", "total s"))
+        for name, (count, total) in phases.items():
+            lines.append("%-48s %6d %9.3f" % (name, count, total))
+        lines.append("%-48s %6s %9.3f" % ("wall time", "", time.perf_counter() - self.start))
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Return the calls and phases in the Chrome trace event format, for chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        events = []
+        for phase in self.phases:
+            events.append({'name': phase['name'], 'cat': 'phase', 'ph': 'X', 'pid': pid, 'tid': phase['thread'],
+                           'ts': phase['start'] * 1e6, 'dur': phase['duration'] * 1e6})
+        for call in self.calls:
+            events.append({'name': call['endpoint'], 'cat': 'http', 'ph': 'X', 'pid': pid, 'tid': call['thread'],
+                           'ts': call['start'] * 1e6, 'dur': call['duration'] * 1e6,
+                           'args': {key: call[key] for key in ('url', 'status', 'latency', 'bytes', 'retries')}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def parse_options(argv):
+    """
+    Take --trace[=<file>] and --profile[=<file>] out of argv, wherever they are. Returns the
+    remaining argv and the two options: None when not given, True, or the file name. Without
+    --trace, BEAGLE_TRACE=1 enables tracing and any other value names the trace file.
+    """
+    options = {'--trace': None, '--profile': None}
+    remaining = []
+    for arg in argv:
+        name, _, value = arg.partition('=')
+        if name in options:
+            options[name] = value or True
+        else:
+            remaining.append(arg)
+    trace = options['--trace']
+    if trace is None:
+        env = os.environ.get('BEAGLE_TRACE', '')
+        if env.lower() in ('1', 'true', 'yes'):
+            trace = True
+        elif env and env.lower() not in ('0', 'false', 'no'):
+            trace = env
+    return remaining, trace, options['--profile']
+
+
+def trace_response(response, *args, **kwargs):
+    """Response hook recording the call, reading the body so its download time is included."""
+    tracer = TRACER
+    if tracer is None:
+        return
+    headers_received = time.perf_counter()
+    latency = response.elapsed.total_seconds()
+    size = len(response.content or b"")
+    history = getattr(getattr(response.raw, 'retries', None), 'history', None) or ()
+    tracer.record_call(response.request.method, response.url, response.status_code, headers_received - latency,
+                       time.perf_counter() - headers_received + latency, latency, size, len(history))
+
+
+def record_retry(method, url):
+    tracer = TRACER
+    if tracer is not None:
+        tracer.record_retry(method, url)
+
+
+def phase(name):
+    """Context manager timing a phase of the command when tracing is enabled."""
+    if TRACER is None:
+        return nullcontext()
+    return _phase(TRACER, name)
+
+
+@contextmanager
+def _phase(tracer, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.record_phase(name, start, time.perf_counter() - start)
+
+
+@contextmanager
+def tracing(trace):
+    """
+    Trace the calls and phases of the block when trace is set, then print the summary
+    to stderr and, when trace names a file, write the Chrome trace to it.
+    """
+    global TRACER
+    if not trace:
+        yield
+        return
+    TRACER = tracer = Tracer()
+    try:
+        yield
+    finally:
+        TRACER = None
+        print(tracer.summary(), file=sys.stderr)
+        if trace is not True:
+            with open(trace, 'w') as trace_file:
+                json.dump(tracer.chrome_trace(), trace_file)
+            print("Trace written to %s" % trace, file=sys.stderr)
+
+
+@contextmanager
+def profiling(profile):
+    """
+    Profile the block with cProfile when profile is set, writing the stats to the file it names,
+    or printing the functions with the most cumulative time to stderr. Only the main thread
+    is profiled, so time spent waiting on worker threads shows up as waits.
+    """
+    if not profile:
+        yield
+        return
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if profile is True:
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        else:
+            profiler.dump_stats(profile)
+            print("Profile written to %s" % profile, file=sys.stderr)
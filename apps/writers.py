@@ -0,0 +1,259 @@
+import csv
+import json
+import os
+import sys
+import tempfile
+
+FORMATS = ('tsv', 'csv', 'ndjson', 'parquet', 'arrow')
+
+# Rows buffered per Parquet row group or Arrow record batch
+BATCH_SIZE = 10000
+
+
+class TsvWriter(object):
+    """
+    Tab separated rows behind a redact(y/n) column, the layout submit-runs --run-file reads.
+    Values are written with str() as before.
+    """
+
+    def __init__(self, stream, columns=None):
+        self.stream = stream
+        self.columns = columns
+        self.header = False
+
+    def _write_header(self):
+        self.stream.write("redact(y/n)\t" + "\t".join(self.columns) + "\n")
+        self.header = True
+
+    def write(self, row):
+        if not self.header:
+            self.columns = self.columns or list(row)
+            self._write_header()
+        self.stream.write("n\t" + "\t".join(str(row.get(column)) for column in self.columns) + "\n")
+
+    def close(self):
+        if not self.header and self.columns:
+            self._write_header()
+
+
+class CsvWriter(object):
+
+    def __init__(self, stream, columns=None):
+        self.columns = columns
+        self.writer = csv.writer(stream)
+        self.header = False
+
+    def write(self, row):
+        if not self.header:
+            self.columns = self.columns or list(row)
+            self.writer.writerow(self.columns)
+            self.header = True
+        self.writer.writerow([_scalar(row.get(column)) for column in self.columns])
+
+    def close(self):
+        if not self.header and self.columns:
+            self.writer.writerow(self.columns)
+
+
+class NdjsonWriter(object):
+
+    def __init__(self, stream, columns=None):
+        self.stream = stream
+
+    def write(self, row):
+        self.stream.write(json.dumps(row) + "\n")
+
+    def close(self):
+        pass
+
+
+class ArrowBatchWriter(object):
+    """
+    Spool rows to a temporary file while the type of every column is inferred from all of them,
+    then write them in batches of BATCH_SIZE once the schema is known. Without columns, every
+    column seen in any row is kept. Columns holding both ints and floats are stored as floats,
+    columns holding other mixed types as text, and nested values as JSON strings.
+    """
+
+    def __init__(self, stream, columns=None):
+        self.pyarrow = import_pyarrow()
+        self.stream = stream
+        self.columns = columns
+        self.types = {}  # column -> type inferred so far, in the order the columns were seen
+        self.rows = []
+        self.spool = tempfile.TemporaryFile('w+')
+
+    def write(self, row):
+        self.rows.append({key: _scalar(value) for key, value in row.items()})
+        if len(self.rows) >= BATCH_SIZE:
+            self._spool()
+
+    def _infer_type(self, values):
+        pa = self.pyarrow
+        try:
+            return pa.array(values).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            return pa.string()
+
+    def _unify(self, current, data_type):
+        pa = self.pyarrow
+        if current is None or pa.types.is_null(current):
+            return data_type
+        if pa.types.is_null(data_type) or current == data_type:
+            return current
+        numeric = (pa.types.is_integer(current) or pa.types.is_floating(current)) and \
+            (pa.types.is_integer(data_type) or pa.types.is_floating(data_type))
+        if numeric:
+            return pa.float64()
+        return pa.string()
+
+    def _spool(self):
+        columns = self.columns or dict.fromkeys(key for row in self.rows for key in row)
+        for column in columns:
+            values = [row.get(column) for row in self.rows]
+            self.types[column] = self._unify(self.types.get(column), self._infer_type(values))
+        for row in self.rows:
+            self.spool.write(json.dumps(row) + "\n")
+        self.rows = []
+
+    def _array(self, values, field):
+        pa = self.pyarrow
+        if pa.types.is_string(field.type):
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        return pa.array(values, type=field.type)
+
+    def _schema(self):
+        pa = self.pyarrow
+        return pa.schema([pa.field(column, pa.string() if pa.types.is_null(data_type) else data_type)
+                          for column, data_type in self.types.items()])
+
+    def _batches(self, schema):
+        self.spool.seek(0)
+        rows = []
+        for line in self.spool:
+            rows.append(json.loads(line))
+            if len(rows) >= BATCH_SIZE:
+                yield self._batch(rows, schema)
+                rows = []
+        if rows:
+            yield self._batch(rows, schema)
+
+    def _batch(self, rows, schema):
+        arrays = [self._array([row.get(field.name) for row in rows], field) for field in schema]
+        return self.pyarrow.record_batch(arrays, schema=schema)
+
+    def close(self):
+        self._spool()
+        schema = self._schema()
+        self.writer = self.open(self.stream, schema)
+        try:
+            for batch in self._batches(schema):
+                self.write_batch(batch)
+        finally:
+            self.writer.close()
+            self.spool.close()
+
+
+class ParquetWriter(ArrowBatchWriter):
+    """Write each batch as a Parquet row group."""
+
+    def open(self, stream, schema):
+        return self.pyarrow.parquet.ParquetWriter(stream, schema)
+
+    def write_batch(self, batch):
+        self.writer.write_table(self.pyarrow.Table.from_batches([batch]))
+
+
+class ArrowWriter(ArrowBatchWriter):
+    """Write each batch to an Arrow IPC file."""
+
+    def open(self, stream, schema):
+        return self.pyarrow.ipc.new_file(stream, schema)
+
+    def write_batch(self, batch):
+        self.writer.write_batch(batch)
+
+
+WRITERS = {
+    'tsv': TsvWriter,
+    'csv': CsvWriter,
+    'ndjson': NdjsonWriter,
+    'parquet': ParquetWriter,
+    'arrow': ArrowWriter,
+}
+
+BINARY_FORMATS = ('parquet', 'arrow')
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet and Arrow output require pyarrow, install it with: pip install beaglecli[parquet]")
+    return pyarrow
+
+
+def flatten(value, prefix=""):
+    """Flatten nested dicts into {"key.subkey": value}, like json_normalize."""
+    flat = {}
+    for key, item in value.items():
+        if isinstance(item, dict):
+            flat.update(flatten(item, prefix + key + "."))
+        else:
+            flat[prefix + key] = item
+    return flat
+
+
+def _scalar(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def output_format(path, output_format=None, default='tsv'):
+    """
+    Return the requested format, or the one matching the file extension, falling back to default.
+    Raises ValueError for unknown formats, or for parquet and arrow when pyarrow is missing.
+    """
+    if output_format:
+        if output_format not in WRITERS:
+            raise ValueError("Unknown output format %s, expected one of: %s" % (output_format, ", ".join(FORMATS)))
+    else:
+        extension = os.path.splitext(path or "")[1].lstrip('.').lower()
+        output_format = extension if extension in WRITERS else default
+    if output_format in BINARY_FORMATS:
+        import_pyarrow()
+    return output_format
+
+
+def write_rows(rows, path, output_format='tsv', columns=None):
+    """
+    Write rows (dicts) to path, or stdout when path is '-', as they are produced.
+    Without columns, they are taken from the first row, or from all rows for
+    parquet and arrow. The file is written under a temporary name and only
+    replaces path once every row is written. Returns the number of rows.
+    """
+    binary = output_format in BINARY_FORMATS
+    if path == '-':
+        stream = sys.stdout.buffer if binary else sys.stdout
+    else:
+        tmp_path = "%s.tmp-%d" % (path, os.getpid())
+        stream = open(tmp_path, 'wb' if binary else 'w', newline=None if binary else '')
+    count = 0
+    try:
+        writer = WRITERS[output_format](stream, columns)
+        for row in rows:
+            writer.write(row)
+            count += 1
+        writer.close()
+    except BaseException:
+        if path != '-':
+            stream.close()
+            os.unlink(tmp_path)
+        raise
+    if path != '-':
+        stream.close()
+        os.replace(tmp_path, path)
+    return count
@@ -0,0 +1,176 @@
+"""
+Measures beaglecli commands end to end against a local mock Beagle and LimsRest.
+
+The mock server (mock_server.py) is started with synthetic data of the requested scale and every
+scenario runs beaglecli in a new process, with its own HOME and cache directory and a fresh working
+directory. One untimed run of each scenario logs in and warms the pipeline cache. For each scenario
+the median wall time, the peak resident memory of the process, the HTTP calls it made and the
+records handled per second are reported. Save the results with --output and compare a later run
+against them with --compare.
+
+Usage:
+
+    python3 scripts/benchmarks/cli.py [--requests=5] [--samples=20] [--files-per-sample=4]
+        [--output-depth=1] [--delay=SECONDS] [--error-rate=0.05] [--capacity=8] [--parallel=4] [--repeat=3]
+        [--scenarios=startup,files-list,...] [--output=results.json] [--compare=baseline.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BEAGLECLI = os.path.join(ROOT, 'beaglecli')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import serve  # noqa: E402
+
+# Variables of the calling shell that would change what is measured
+CLEARED_ENV = ('BEAGLE_RUN_CACHE', 'BEAGLE_TRACE', 'BEAGLE_SOCKET', 'LIMS_CACHE')
+
+
+def request_ids_file(data, workdir):
+    path = os.path.join(workdir, 'requests.txt')
+    with open(path, 'w') as f:
+        f.write("\n".join(data.lims_samples) + "\n")
+    return path
+
+
+# name -> function(data, workdir, args) returning (argv, records handled)
+SCENARIOS = {
+    'startup': lambda data, workdir, args: (['--version'], 0),
+    'files-list': lambda data, workdir, args: (
+        ['files', 'list', '--all', '--page-size=1000', '--parallel=%d' % args.parallel,
+         '--output-file=files.json'], len(data.files)),
+    'latest-info': lambda data, workdir, args: (
+        ['run', 'latest-info', '--request-id=%s' % request_ids_file(data, workdir), '--all',
+         '--parallel=%d' % args.parallel, '--output-file=latest.tsv'], len(data.runs)),
+    'access-link': lambda data, workdir, args: (
+        ['access', 'link', '--request-ids-file=%s' % request_ids_file(data, workdir), '--apps=snv',
+         '--workers=%d' % args.parallel], len(data.lims_samples) * args.samples),
+    'cmoch-link-patient': lambda data, workdir, args: (
+        ['cmoch', 'link-patient', '--request-id=%s' % next(iter(data.lims_samples)), '--apps=bams'],
+        2 * args.samples),
+    'lims-metadata': lambda data, workdir, args: (
+        ['lims', 'metadata'] + ['--request-id=%s' % request_id for request_id in data.lims_samples] +
+        ['--workers=%d' % args.parallel, '--no-cache'], len(data.manifests)),
+}
+
+
+def run(argv, cwd, env):
+    """Run beaglecli once, returning its wall time and peak resident memory in bytes."""
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, BEAGLECLI] + argv, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 reports the memory of this process alone, unlike getrusage(RUSAGE_CHILDREN)
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            stderr.seek(0)
+            raise RuntimeError("beaglecli %s exited with %d:\n%s" % (
+                " ".join(argv), process.returncode, stderr.read().decode(errors='replace')))
+    return seconds, usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def measure(name, server, workdir, env, args):
+    argv, records = SCENARIOS[name](server.data, workdir, args)
+    samples, peaks, calls = [], [], []
+    for attempt in range(args.repeat + 1):
+        cwd = tempfile.mkdtemp(dir=workdir)
+        before = sum(server.counter.values())
+        try:
+            seconds, peak = run(argv, cwd, env)
+        finally:
+            shutil.rmtree(cwd)
+        if attempt:
+            samples.append(seconds)
+            peaks.append(peak)
+            calls.append(sum(server.counter.values()) - before)
+    seconds = statistics.median(samples)
+    return {
+        'argv': argv,
+        'seconds': seconds,
+        'min_seconds': min(samples),
+        'peak_rss_mb': max(peaks) / 2 ** 20,
+        'http_calls': max(calls),
+        'records': records,
+        'records_per_second': records / seconds if records else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=20, help='samples per request, and runs per operator run')
+    parser.add_argument('--files-per-sample', type=int, default=4)
+    parser.add_argument('--output-depth', type=int, default=1, help='Directory levels of the nested QC outputs')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds the server adds to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests the server fails with a 502')
+    parser.add_argument('--capacity', type=int, default=0, help='requests the server takes at once before a 429')
+    parser.add_argument('--parallel', type=int, default=4, help='workers passed to the commands that take them')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    args = parser.parse_args()
+
+    scale = {'requests': args.requests, 'samples': args.samples, 'files_per_sample': args.files_per_sample,
+             'output_depth': args.output_depth}
+    print("Generating data for %s" % ", ".join("%s=%s" % item for item in scale.items()), file=sys.stderr)
+    server = serve(0, args.delay, args.error_rate, args.capacity, **scale)
+    endpoint = 'http://127.0.0.1:%d' % server.server_address[1]
+    workdir = tempfile.mkdtemp(prefix='beaglecli-bench-')
+    env = {key: value for key, value in os.environ.items() if key not in CLEARED_ENV}
+    env.update(HOME=workdir, BEAGLE_ENDPOINT=endpoint, BEAGLE_USER='bench', BEAGLE_PW='bench',
+               LIMS_URL=endpoint + '/LimsRest/api', BEAGLE_CACHE_DIR=os.path.join(workdir, 'cache'),
+               BEAGLE_DAEMON='0')
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            compared = json.load(f)
+        baseline = compared['scenarios']
+        if (compared.get('scale'), compared.get('delay'), compared.get('error_rate'), compared.get('capacity')) != (
+                scale, args.delay, args.error_rate, args.capacity):
+            print("Warning: %s was measured with another scale or delay" % args.compare, file=sys.stderr)
+
+    results = {'commit': git_commit(), 'python': sys.version.split()[0], 'scale': scale, 'delay': args.delay,
+               'error_rate': args.error_rate, 'capacity': args.capacity, 'parallel': args.parallel, 'scenarios': {}}
+    print("%-20s %10s %10s %10s %10s %12s %10s" % (
+        'scenario', 'time (ms)', 'min (ms)', 'peak MB', 'calls', 'records/s', 'vs base'))
+    try:
+        for name in args.scenarios.split(','):
+            result = measure(name, server, workdir, env, args)
+            results['scenarios'][name] = result
+            change = ""
+            if name in baseline:
+                change = "%+.1f%%" % (100 * (result['seconds'] / baseline[name]['seconds'] - 1))
+            print("%-20s %10.1f %10.1f %10.1f %10d %12s %10s" % (
+                name, result['seconds'] * 1000, result['min_seconds'] * 1000, result['peak_rss_mb'],
+                result['http_calls'],
+                "%.0f" % result['records_per_second'] if result['records_per_second'] else "-", change))
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
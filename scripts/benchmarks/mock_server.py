@@ -0,0 +1,332 @@
+"""
+Local stand-in for the Beagle API and LimsRest, serving synthetic data for the benchmarks.
+
+It implements the endpoints of the API dict that the benchmarked commands call (token auth,
+files, runs, operator runs and pipelines) and the getRequestSamples and getSampleManifest
+LimsRest endpoints. Every request has one operator run per app, with one run per sample whose
+outputs hold a bam and a QC directory nested --output-depth levels deep. Ids are generated
+from a fixed seed so runs are comparable. GET /__stats__ returns the calls per endpoint.
+--error-rate fails a share of the requests with a 502 page and --capacity answers 429 to the
+requests beyond that many in flight, to see how commands cope with a busy server. Token
+requests are never failed.
+
+Usage:
+
+    python3 scripts/benchmarks/mock_server.py [--port=5007] [--requests=5] [--samples=20]
+        [--files-per-sample=4] [--output-depth=1] [--delay=SECONDS] [--error-rate=0.05] [--capacity=8]
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TOKEN_TTL = 3600
+
+APPS = [
+    ('access legacy SNV', '1.0.0'),
+    ('access legacy', '1.0.0'),
+    ('cmo-ch nucleo', '1.0.0'),
+    ('CMO-CH QC', '1.0.0'),
+]
+
+
+def make_token(ttl=TOKEN_TTL):
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b'=').decode()
+    return '%s.%s.sig' % (part({'alg': 'none'}), part({'exp': time.time() + ttl, 'jti': uuid.uuid4().hex}))
+
+
+def cwl_file(path, secondary=()):
+    return {
+        'class': 'File',
+        'basename': path.rsplit('/', 1)[-1],
+        'location': 'file://' + path,
+        'secondaryFiles': [{'class': 'File', 'basename': s.rsplit('/', 1)[-1], 'location': 'file://' + s,
+                            'secondaryFiles': []} for s in secondary],
+    }
+
+
+def qc_directory(basename, files, depth):
+    """A Directory listing files, wrapped in depth - 1 more levels of Directories."""
+    directory = {'class': 'Directory', 'basename': basename, 'listing': files}
+    for level in range(depth - 1):
+        directory = {'class': 'Directory', 'basename': basename, 'listing': [directory]}
+    return directory
+
+
+class Data(object):
+
+    def __init__(self, requests=5, samples=20, files_per_sample=4, output_depth=1, root='/tmp/beagle-mock-outputs',
+                 seed=0):
+        ids = random.Random(seed)
+
+        def new_id():
+            return str(uuid.UUID(int=ids.getrandbits(128), version=4))
+
+        self.files = []
+        self.runs = {}
+        self.operator_runs = []
+        self.pipelines = []
+        self.lims_samples = {}
+        self.manifests = {}
+        for name, version in APPS:
+            self.pipelines.append({'id': new_id(), 'name': name, 'version': version})
+        created = 0
+        for r in range(requests):
+            request_id = '%05d_%s' % (10000 + r, chr(ord('A') + r % 26))
+            self.lims_samples[request_id] = []
+            for s in range(samples):
+                sample = '%s_%d' % (request_id, s)
+                cmo_id = 'C-P%05d-L%03d-d' % (r, s)
+                self.lims_samples[request_id].append(sample)
+                self.manifests[sample] = {'igoId': sample, 'cmoSampleName': cmo_id, 'investigatorSampleId': 's%d' % s}
+                for f in range(files_per_sample):
+                    self.files.append({
+                        'id': new_id(),
+                        'file_name': '%s_R%d.fastq.gz' % (sample, f),
+                        'path': '/igo/delivery/%s/%s_R%d.fastq.gz' % (request_id, sample, f),
+                        'file_type': 'fastq',
+                        'file_group': 'group',
+                        'size': 1024,
+                        'metadata': {
+                            'igoRequestId': request_id,
+                            'cmoSampleName': cmo_id,
+                            'sampleName': sample,
+                            'sampleClass': 'Tumor',
+                            'cmoPatientId': 'C-P%05d' % r,
+                            'baitSet': ['MSK-ACCESS-v1'],
+                            'qcReports': [{'qcStatus': 'Passed', 'IGORecommendation': 'Passed'}],
+                            'libraries': [{'libraryIgoId': sample + '_1'}],
+                        },
+                    })
+            for (name, version), pipeline in zip(APPS, self.pipelines):
+                operator_run = {
+                    'id': new_id(), 'app_name': name, 'app_version': version, 'status': 'COMPLETED',
+                    'tags': {'igoRequestId': request_id},
+                }
+                self.operator_runs.append(operator_run)
+                for s in range(samples):
+                    cmo_id = 'C-P%05d-L%03d-d' % (r, s)
+                    run_id = new_id()
+                    created += 1
+                    out = '%s/%s' % (root, run_id)
+                    bam = '%s/%s_cl_aln_srt.bam' % (out, cmo_id)
+                    self.runs[run_id] = {
+                        'id': run_id, 'name': 'run %d' % created, 'status': 'COMPLETED',
+                        'app': pipeline['id'], 'operator_run': operator_run['id'], 'message': {},
+                        'tags': {'igoRequestId': request_id, 'cmoSampleIds': [cmo_id]},
+                        'created_date': '2024-01-01T00:%02d:%02d' % (created // 60 % 60, created % 60),
+                        'finished_date': '2024-01-02T00:00:00', 'execution_id': new_id(),
+                        'output_directory': out,
+                        'output_metadata': {'sampleId': cmo_id, 'requestId': request_id},
+                        'outputs': [
+                            {'name': 'bams', 'value': [cwl_file(bam, [bam[:-1] + 'i'])]},
+                            {'name': 'qc', 'value': qc_directory(cmo_id, [
+                                cwl_file('%s/qc/%s_%d.txt' % (out, cmo_id, i)) for i in range(files_per_sample)],
+                                output_depth)},
+                        ],
+                    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None):
+        payload = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length).decode()
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(raw or '{}')
+        return {k: v[0] for k, v in parse_qs(raw).items()}
+
+    def _page(self, items, query):
+        base = 'http://%s:%d%s' % (self.server.server_address[0], self.server.server_address[1], urlparse(self.path).path)
+        if query.get('count'):
+            return {'count': len(items)}
+        page_size = int(query.get('page_size', ['100'])[0] or 100)
+        page = int(query.get('page', ['1'])[0])
+        start = (page - 1) * page_size
+        if start >= len(items) and page != 1:
+            return None
+        results = items[start:start + page_size]
+        nxt = '%s?%s' % (base, '&'.join('%s=%s' % (k, x) for k, v in query.items() if k != 'page' for x in v) +
+                         '&page=%d' % (page + 1)) if start + page_size < len(items) else None
+        return {'count': len(items), 'next': nxt, 'previous': None, 'results': results}
+
+    def _handle(self, method):
+        """Answer like an overloaded or failing server when asked to, otherwise route the request."""
+        server = self.server
+        path = urlparse(self.path).path
+        if path != '/__stats__' and 'api-token' not in path:
+            with server.lock:
+                server.in_flight += 1
+                overloaded = server.capacity and server.in_flight > server.capacity
+                failed = not overloaded and server.random.random() < server.error_rate
+            try:
+                if overloaded or failed:
+                    self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                    server.counter['<429>' if overloaded else '<502>'] += 1
+                    if overloaded:
+                        return self._send(429, {'detail': 'Request was throttled.'})
+                    return self._send_html(502, '<html><body><h1>502 Bad Gateway</h1></body></html>')
+                return self._route(method)
+            finally:
+                with server.lock:
+                    server.in_flight -= 1
+        return self._route(method)
+
+    def _send_html(self, status, text):
+        payload = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _route(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        if method in ('POST', 'PATCH', 'PUT'):
+            self.body = self._body()
+        if path == '/__stats__':
+            return self._send(200, dict(server.counter))
+        server.counter[re.sub(r'[0-9a-f-]{36}', '<id>', path)] += 1
+        if server.delay:
+            time.sleep(server.delay)
+        data = server.data
+        if path.endswith('api-token-auth/'):
+            return self._send(200, {'access': make_token(), 'refresh': make_token(TOKEN_TTL * 24)})
+        if path.endswith('api-token-verify/'):
+            return self._send(200, {})
+        if path.endswith('api-token-refresh/'):
+            return self._send(200, {'access': make_token(), 'refresh': make_token(TOKEN_TTL * 24)})
+        if path.startswith('/LimsRest/api/getRequestSamples'):
+            request_id = query['request'][0]
+            return self._send(200, {'samples': [{'igoSampleId': s} for s in data.lims_samples.get(request_id, [])]})
+        if path.startswith('/LimsRest/api/getSampleManifest'):
+            return self._send(200, [data.manifests[s] for s in query.get('igoSampleId', []) if s in data.manifests])
+        if path.rstrip('/').endswith('v0/run/pipelines'):
+            return self._send(200, self._page(data.pipelines, query))
+        if path.startswith('/v0/fs/files'):
+            file_id = path[len('/v0/fs/files/'):].strip('/')
+            if method == 'DELETE':
+                return self._send(204)
+            if method in ('POST', 'PATCH', 'PUT'):
+                body = dict(self.body)
+                body.setdefault('id', file_id or str(uuid.uuid4()))
+                return self._send(201 if method == 'POST' else 200, body)
+            files = data.files
+            for item in query.get('metadata', []):
+                key, value = item.split(':', 1)
+                files = [f for f in files if f['metadata'].get(key) == value]
+            if query.get('path'):
+                paths = set(query['path'])
+                files = [f for f in files if f['path'] in paths]
+            page = self._page(files, query)
+            return self._send(200 if page else 404, page or {'detail': 'Invalid page.'})
+        if path.startswith('/v0/etl/jobs/'):
+            return self._send(204)
+        if path.startswith('/v0/run/operator-runs'):
+            runs = data.operator_runs
+            if query.get('app_name'):
+                runs = [r for r in runs if r['app_name'] == query['app_name'][0]]
+            if query.get('tags'):
+                tags = json.loads(query['tags'][0])
+                runs = [r for r in runs if all(r['tags'].get(k) == v for k, v in tags.items())]
+            return self._send(200, self._page(runs, query))
+        if path.startswith('/v0/run/api/'):
+            run_id = path[len('/v0/run/api/'):].strip('/')
+            if run_id:
+                run = data.runs.get(run_id)
+                return self._send(200 if run else 404, run or {'detail': 'Not found.'})
+            runs = list(data.runs.values())
+            if query.get('operator_run'):
+                runs = [r for r in runs if r['operator_run'] == query['operator_run'][0]]
+            if query.get('request_ids'):
+                ids = set(query['request_ids'])
+                runs = [r for r in runs if r['tags']['igoRequestId'] in ids]
+            if query.get('apps'):
+                apps = set(query['apps'])
+                runs = [r for r in runs if r['app'] in apps]
+            if query.get('status'):
+                runs = [r for r in runs if r['status'] == query['status'][0]]
+            if not query.get('full'):
+                runs = [{k: v for k, v in r.items() if k not in ('outputs', 'output_metadata')} for r in runs]
+            page = self._page(runs, query)
+            return self._send(200 if page else 404, page or {'detail': 'Invalid page.'})
+        return self._send(404, {'detail': 'Not found.'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def serve(port=0, delay=0.0, error_rate=0.0, capacity=0, **scale):
+    """
+    Start the server on a background thread. error_rate is the share of requests answered with
+    a 502 HTML page, and requests beyond capacity in flight (0 for no limit) get a 429.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.data = Data(**scale)
+    server.counter = Counter()
+    server.delay = delay
+    server.error_rate = error_rate
+    server.capacity = capacity
+    server.in_flight = 0
+    server.lock = threading.Lock()
+    server.random = random.Random(1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=5007)
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--files-per-sample', type=int, default=4)
+    parser.add_argument('--output-depth', type=int, default=1)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with a 502')
+    parser.add_argument('--capacity', type=int, default=0, help='requests in flight before answering 429')
+    args = parser.parse_args()
+    srv = serve(args.port, args.delay, args.error_rate, args.capacity, requests=args.requests, samples=args.samples,
+                files_per_sample=args.files_per_sample, output_depth=args.output_depth)
+    print('listening on %d' % srv.server_address[1], flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,94 @@
+"""
+Measures beaglecli startup cost for each command path.
+
+For every command path the modules that path imports are loaded in a fresh
+interpreter and the import time is reported, together with the wall time of
+the commands that exit before any network call (`--version`, bad usage).
+
+Usage:
+
+    python3 scripts/benchmarks/startup.py [--repeat=N] [--output=results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BEAGLECLI = os.path.join(ROOT, 'beaglecli')
+
+# Modules imported by each command path on top of the beaglecli script itself
+COMMAND_PATHS = {
+    'beaglecli': [],
+    'files list': ['apps.client'],
+    'files list --packaged': ['apps.client', 'apps.cleaning'],
+    'run list': ['apps.client'],
+    'access link': ['apps.client', 'apps.access'],
+    'cmoch link': ['apps.client', 'apps.cmoch'],
+    'lims metadata': ['apps.client', 'apps.lims'],
+}
+
+# Invocations that must return before authenticating
+EXIT_EARLY = {
+    '--version': ['--version'],
+    'bad usage': ['files', 'frobnicate'],
+}
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import docopt
+for name in %r:
+    __import__(name)
+print(time.perf_counter() - start)
+"""
+
+
+def measure_imports(modules, repeat):
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SNIPPET % (modules,)], cwd=ROOT)
+        samples.append(float(output.decode().strip()))
+    return statistics.median(samples)
+
+
+def measure_invocation(argv, repeat):
+    samples = []
+    env = dict(os.environ, HOME=os.environ.get('HOME', ROOT))
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, BEAGLECLI] + argv, cwd=ROOT, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = {'imports': {}, 'invocations': {}}
+    print("%-24s %12s" % ('command path', 'import (ms)'))
+    for name, modules in COMMAND_PATHS.items():
+        seconds = measure_imports(modules, args.repeat)
+        results['imports'][name] = seconds
+        print("%-24s %12.1f" % (name, seconds * 1000))
+    print()
+    print("%-24s %12s" % ('invocation', 'wall (ms)'))
+    for name, argv in EXIT_EARLY.items():
+        seconds = measure_invocation(argv, args.repeat)
+        results['invocations'][name] = seconds
+        print("%-24s %12.1f" % (name, seconds * 1000))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures find_files_by_sample on synthetic CWL outputs.
+
+Each output is a list of per-sample entries mixing {sampleId, file} records,
+nested Directories and bare Files with secondaryFiles, so the benchmark covers
+every branch of the traversal.
+
+Usage:
+
+    python3 scripts/benchmarks/traversal.py [--files=10000,50000,100000] [--repeat=N] [--output=results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from apps.runs import find_files_by_sample  # noqa: E402
+
+
+def cwl_file(path):
+    return {
+        "class": "File",
+        "location": "file://" + path,
+        "secondaryFiles": [{"class": "File", "location": "file://" + path + ".bai"}],
+    }
+
+
+def synthetic_output(file_count, samples=100):
+    """Build an output value holding about file_count files, secondaryFiles included."""
+    output = []
+    per_entry = 2
+    for i in range(file_count // (per_entry * 3)):
+        sample_id = "C-%06d-L001-d" % (i % samples)
+        output.append({"sampleId": sample_id, "file": cwl_file("/out/%s_%d.bam" % (sample_id, i))})
+        output.append({"class": "Directory", "basename": sample_id,
+                       "listing": [[cwl_file("/out/%s/%d.txt" % (sample_id, i))]]})
+        output.append(cwl_file("/out/%d.vcf" % i))
+    return output
+
+
+def measure(file_count, repeat):
+    output = synthetic_output(file_count)
+    samples = []
+    found = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found = sum(1 for _ in find_files_by_sample(output))
+        samples.append(time.perf_counter() - start)
+    return found, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', default='10000,50000,100000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = {}
+    print("%12s %12s %12s %14s" % ('requested', 'found', 'time (ms)', 'files/s'))
+    for file_count in [int(n) for n in args.files.split(',')]:
+        found, seconds = measure(file_count, args.repeat)
+        results[file_count] = {'found': found, 'seconds': seconds}
+        print("%12d %12d %12.1f %14.0f" % (file_count, found, seconds * 1000, found / seconds))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
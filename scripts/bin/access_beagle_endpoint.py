@@ -2,6 +2,9 @@ import requests
 import sys, os
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from apps.client import create_session
+
 class AccessBeagleEndpoint:
   def __init__(self):
     username = os.environ['BEAGLE_USER']
@@ -9,12 +12,14 @@ class AccessBeagleEndpoint:
     BEAGLE_ENDPOINT = os.environ['BEAGLE_ENDPOINT']
     self.auth = requests.auth.HTTPBasicAuth(username, password)
     self.API = BEAGLE_ENDPOINT
+    # shares the pool size, timeouts and retries of beaglecli
+    self.session = create_session(auth=self.auth, verify=False)
 
   def run_url(self, url):
     """
     Runs the url, which should contain all the parameters we'd need
     """
-    req = requests.get(url, auth=self.auth, verify=False)
+    req = self.session.get(url)
     return req.json()
 
   def get_file_ids(self, request_id):
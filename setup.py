@@ -11,5 +11,6 @@ setuptools.setup(
     description="Beagle API command line tool",
     url="https://github.com/mskcc/beagle_cli",
     packages=setuptools.find_packages(),
-    install_requires = install_requires
+    install_requires = install_requires,
+    extras_require = {'parquet': ['pyarrow']}
 )
@@ -0,0 +1,14 @@
+import importlib.util
+import os
+from importlib.machinery import SourceFileLoader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_beaglecli():
+    """Import the beaglecli script, which has no .py extension, as a module."""
+    loader = SourceFileLoader('beaglecli', os.path.join(ROOT, 'beaglecli'))
+    spec = importlib.util.spec_from_loader('beaglecli', loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
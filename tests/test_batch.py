@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from apps.batch import read_operations, run_operations
+from apps.client import concurrent_map, record_failure
+from tests import load_beaglecli
+
+beaglecli = load_beaglecli()
+
+
+class Response(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def operations(*argvs):
+    return [(number, {'argv': argv}) for number, argv in enumerate(argvs, 1)]
+
+
+class RunOperationsTest(unittest.TestCase):
+
+    def run_all(self, execute, argvs, workers=4):
+        return {result['line']: result for result in run_operations(operations(*argvs), execute, workers)}
+
+    def test_prints_of_nested_worker_threads_are_captured_per_operation(self):
+        barrier = threading.Barrier(2)
+
+        def execute(argv):
+            barrier.wait(timeout=5)
+
+            def work(item):
+                print("%s %d" % (argv[0], item))
+                return item
+
+            return json.dumps(list(concurrent_map(work, range(3), workers=3)))
+
+        results = self.run_all(execute, [['a'], ['b']], workers=2)
+        for line, name in ((1, 'a'), (2, 'b')):
+            self.assertTrue(results[line]['ok'])
+            self.assertEqual(results[line]['result'], [0, 1, 2])
+            self.assertEqual(sorted(results[line]['output'].splitlines()), ['%s 0' % name, '%s 1' % name, '%s 2' % name])
+
+    def test_stdout_is_restored(self):
+        stdout = sys.stdout
+        list(run_operations(operations(['a']), lambda argv: None))
+        self.assertIs(sys.stdout, stdout)
+
+    def test_failed_responses_fail_the_operation(self):
+        def execute(argv):
+            # as the client's response hook would, from a worker thread of the operation
+            list(concurrent_map(lambda status: record_failure(Response(status)), [200, int(argv[0])]))
+            return json.dumps({'detail': 'Not found.'})
+
+        results = self.run_all(execute, [['404'], ['200']])
+        self.assertEqual((results[1]['ok'], results[1]['status_code'], results[1]['error']), (False, 404, "HTTP 404"))
+        self.assertEqual(results[1]['result'], {'detail': 'Not found.'})
+        self.assertTrue(results[2]['ok'])
+        self.assertNotIn('status_code', results[2])
+
+    def test_errors_and_exits_fail_the_operation(self):
+        def execute(argv):
+            if argv == ['error']:
+                return "Error: bad input"
+            if argv == ['exit']:
+                sys.exit("usage")
+            raise KeyError('missing')
+
+        results = self.run_all(execute, [['error'], ['exit'], ['raise']])
+        self.assertEqual([results[line]['error'] for line in (1, 2, 3)],
+                         ["Error: bad input", "usage", "KeyError: 'missing'"])
+        self.assertFalse(any(result['ok'] for result in results.values()))
+
+    def test_invalid_lines_are_reported(self):
+        parsed = list(read_operations(['{"argv": ["run", "get", "1"], "id": 7}', '', '# comment',
+                                       '"files delete --file-id=2"', '{"nothing": 1}']))
+        self.assertEqual(parsed[0], (1, {'argv': ['run', 'get', '1'], 'id': 7}))
+        self.assertEqual(parsed[1][1]['argv'], ['files', 'delete', '--file-id=2'])
+        self.assertEqual(parsed[2][0], 5)
+        self.assertIsNone(parsed[2][1]['argv'])
+
+
+class BatchCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def batch(self, lines, authenticated=True):
+        operations_file = os.path.join(self.root, 'ops.jsonl')
+        output_file = os.path.join(self.root, 'results.jsonl')
+        with open(operations_file, 'w') as f:
+            f.write("\n".join(json.dumps(line) for line in lines) + "\n")
+        commands = []
+
+        def command(arguments, config):
+            commands.append(arguments)
+            return "{}"
+
+        with mock.patch.object(beaglecli, 'command', side_effect=command), \
+                mock.patch.object(beaglecli, '_check_is_authenticated', return_value=authenticated), \
+                mock.patch('sys.stderr'):
+            beaglecli._batch_command({'<operations>': operations_file, '--output-file': output_file,
+                                      '--workers': '2', '--ordered': True}, None)
+        with open(output_file) as f:
+            return [json.loads(line) for line in f], commands
+
+    def test_shell_daemon_and_batch_are_rejected(self):
+        results, commands = self.batch(['shell', 'daemon', 'batch', 'run get 1'])
+        self.assertEqual([result['ok'] for result in results], [False, False, False, True])
+        self.assertIn("cannot be run as a batch operation", results[0]['error'])
+        self.assertEqual(len(commands), 1)
+
+    def test_operations_fail_when_the_session_cannot_be_refreshed(self):
+        results, commands = self.batch(['run get 1'], authenticated=False)
+        self.assertFalse(results[0]['ok'])
+        self.assertIn("log in again", results[0]['error'])
+        self.assertEqual(commands, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from apps import cache as cache_module
+from apps.cache import Cache, get_cached_run
+
+
+def response(status_code, body):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body.encode()
+    return response
+
+
+class Client(object):
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def get(self, path):
+        return self.responses.pop(0)
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, 'cache', 'test.sqlite')
+
+    def stored_size(self, cache):
+        return cache._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def test_size_follows_sets_replaces_and_deletes(self):
+        cache = Cache(self.path)
+        cache.set('a', {'value': 'x' * 100})
+        cache.set('b', [1, 2, 3])
+        self.assertEqual(cache.size(), self.stored_size(cache))
+        cache.set('a', 'short')
+        self.assertEqual(cache.size(), self.stored_size(cache))
+        cache.delete('b')
+        self.assertEqual(cache.size(), self.stored_size(cache))
+        cache.clear()
+        self.assertEqual(cache.size(), 0)
+
+    def test_expired_entries_are_dropped(self):
+        cache = Cache(self.path)
+        cache.set('a', 'value', ttl=-1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size(), 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = Cache(self.path)
+        for key in 'abc':
+            cache.set(key, key * 1000)
+        entry = cache.size() // 3
+        cache.max_bytes = 3 * entry
+        cache.get('a')
+        cache.set('d', 'd' * 1000)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in 'acd'], ['a' * 1000, 'c' * 1000, 'd' * 1000])
+        self.assertLessEqual(cache.size(), cache.max_bytes)
+        self.assertEqual(cache.size(), self.stored_size(cache))
+
+    def test_set_under_the_limit_does_not_sum_the_entries(self):
+        cache = Cache(self.path, max_bytes=2 ** 20)
+        statements = []
+        cache._db.set_trace_callback(statements.append)
+        cache.set('a', 'value')
+        self.assertFalse([statement for statement in statements if 'SUM' in statement.upper()])
+        self.assertFalse([statement for statement in statements if 'ORDER BY' in statement.upper()])
+
+    def test_existing_cache_gets_its_size_on_open(self):
+        os.makedirs(os.path.dirname(self.path))
+        db = sqlite3.connect(self.path)
+        db.execute("CREATE TABLE entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL)")
+        db.execute("INSERT INTO entries VALUES ('a', x'00', 10, NULL, 0), ('b', x'00', 5, NULL, 0)")
+        db.commit()
+        db.close()
+        cache = Cache(self.path)
+        self.assertEqual(cache.size(), 15)
+        cache.delete('a')
+        self.assertEqual(cache.size(), 5)
+
+    def test_size_is_shared_between_connections(self):
+        first, second = Cache(self.path), Cache(self.path)
+        first.set('a', 'value')
+        second.set('b', 'other value')
+        self.assertEqual(first.size(), self.stored_size(first))
+
+
+class GetCachedRunTest(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        for patcher in (mock.patch.object(cache_module, 'CACHE_DIR', root),
+                        mock.patch.object(cache_module, 'RUN_CACHE_ENABLED', True),
+                        mock.patch.dict(cache_module._caches, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_failed_requests_are_not_cached(self):
+        client = Client(response(404, '{"detail": "Not found.", "status": "FAILED"}'),
+                        response(200, '{"id": "1", "status": "COMPLETED"}'))
+        self.assertEqual(get_cached_run(client, '/v0/run/api/', '1')['detail'], "Not found.")
+        self.assertEqual(get_cached_run(client, '/v0/run/api/', '1')['id'], "1")
+        self.assertEqual(get_cached_run(Client(), '/v0/run/api/', '1')['id'], "1")
+
+    def test_failed_requests_raise_when_asked(self):
+        for failure in (response(404, '{"detail": "Not found."}'), response(502, '<html>Bad Gateway</html>')):
+            with self.assertRaises(requests.HTTPError):
+                get_cached_run(Client(failure), '/v0/run/api/', '1', raise_for_status=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from apps import client
+from apps.client import AdaptiveLimit, create_session
+
+PAGES = "GET /v0/fs/files/?page,page_size"
+
+
+def endpoint(method, url, params=None):
+    return client._endpoint(requests.Request(method, url, params=params).prepare())
+
+
+class AdaptiveLimitTest(unittest.TestCase):
+
+    def fill(self, limit):
+        """Send as many requests as the limit allows, returning when they were sent."""
+        return [limit.acquire() for _ in range(int(limit.limit))]
+
+    def release_all(self, limit, sent, endpoint, latency=None, congested=False):
+        for at in sent:
+            limit.release(at, endpoint, latency, congested)
+
+    def test_grows_while_the_limit_is_reached(self):
+        limit = AdaptiveLimit(10, initial=2)
+        for _ in range(8):
+            # only the first request released finds the limit reached
+            self.release_all(limit, self.fill(limit), PAGES, 0.1)
+        self.assertEqual(limit.limit, 10)
+
+    def test_does_not_grow_when_the_limit_is_not_reached(self):
+        limit = AdaptiveLimit(10, initial=4)
+        for _ in range(5):
+            limit.release(limit.acquire(), PAGES, 0.1)
+        self.assertEqual(limit.limit, 4)
+
+    def test_fast_count_probe_does_not_make_pages_look_slow(self):
+        url = "http://beagle/v0/fs/files/"
+        limit = AdaptiveLimit(8, initial=2)
+        limit.release(limit.acquire(), endpoint('GET', url, {'count': True}), 0.002)
+        for page in range(10):
+            pages = endpoint('GET', url, {'page': page + 1, 'page_size': 1000})
+            self.release_all(limit, self.fill(limit), pages, 0.5)
+        self.assertEqual(limit.limit, 8)
+
+    def test_latency_needs_several_samples_before_shrinking_the_limit(self):
+        limit = AdaptiveLimit(8, initial=8)
+        for _ in range(client.LATENCY_SAMPLES - 1):
+            limit.release(limit.acquire(), PAGES, 0.01)
+        limit.release(limit.acquire(), PAGES, 1.0)
+        self.assertEqual(limit.limit, 8)
+        limit.release(limit.acquire(), PAGES, 1.0)
+        self.assertEqual(limit.limit, 8 * client.LATENCY_BACKOFF)
+
+    def test_congestion_halves_the_limit_once_per_burst(self):
+        limit = AdaptiveLimit(8, initial=8)
+        sent = self.fill(limit)
+        self.release_all(limit, sent, PAGES, 0.1, congested=True)
+        self.assertEqual(limit.limit, 4)
+        # requests sent after the decrease can shrink it again
+        self.release_all(limit, self.fill(limit), PAGES, 0.1, congested=True)
+        self.assertEqual(limit.limit, 2)
+
+    def test_never_below_one(self):
+        limit = AdaptiveLimit(8, initial=1)
+        for _ in range(5):
+            self.release_all(limit, self.fill(limit), PAGES, congested=True)
+        self.assertEqual(limit.limit, 1)
+
+
+class SlowServer(ThreadingHTTPServer):
+    """Local server answering GET requests after the delay set on it."""
+
+    def __init__(self):
+        self.delay = 0.0
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(handler):
+                time.sleep(self.delay)
+                handler.send_response(200)
+                handler.send_header('Content-Length', '2')
+                handler.end_headers()
+                handler.wfile.write(b'{}')
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+
+
+class AdaptiveHTTPAdapterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SlowServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/v0/fs/files/' % self.server.server_address[1]
+        self.session = create_session()
+        self.addCleanup(self.session.close)
+        self.limit = self.session.get_adapter(self.url).limit
+
+    def test_slow_responses_shrink_the_limit(self):
+        initial = self.limit.limit
+        for _ in range(client.LATENCY_SAMPLES):
+            self.session.get(self.url).raise_for_status()
+        self.assertEqual(self.limit.limit, initial)
+        self.server.delay = 0.2
+        self.session.get(self.url).raise_for_status()
+        self.assertEqual(self.limit.limit, initial * client.LATENCY_BACKOFF)
+
+
+class EndpointTest(unittest.TestCase):
+
+    def test_probe_pages_and_ids_are_told_apart(self):
+        url = "http://beagle/v0/fs/files/"
+        probe = endpoint('GET', url, {'count': True, 'path': ['a', 'b']})
+        first = endpoint('GET', url, {'page': 1, 'page_size': 1000, 'path': ['a', 'b']})
+        second = endpoint('GET', url, {'page': 2, 'page_size': 1000, 'path': ['a', 'b']})
+        self.assertEqual(first, second)
+        self.assertNotEqual(probe, first)
+        self.assertEqual(endpoint('GET', "http://beagle/v0/run/api/1234/"),
+                         endpoint('GET', "http://beagle/v0/run/api/5678/"))
+        self.assertEqual(endpoint('GET', "http://beagle/v0/run/api/1234/"), "GET /v0/run/api/<id>/?")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import unittest
+from unittest import mock
+
+from docopt import docopt
+
+from apps import daemon
+from tests import load_beaglecli
+
+beaglecli = load_beaglecli()
+
+ENVIRON = {'HOME': '/home/user', 'BEAGLE_ENDPOINT': 'http://beagle', 'LIMS_URL': 'http://lims', 'PATH': '/bin'}
+
+
+class SettingsTest(unittest.TestCase):
+
+    def test_configuring_variables_are_compared(self):
+        for name, value in (('BEAGLE_ENDPOINT', 'http://other'), ('LIMS_URL', 'http://other'), ('HOME', '/root'),
+                            ('BEAGLE_RUN_CACHE', '1')):
+            self.assertNotEqual(daemon.settings(dict(ENVIRON, **{name: value})), daemon.settings(ENVIRON), name)
+
+    def test_other_variables_are_not(self):
+        for name in ('PATH', 'BEAGLE_DAEMON', 'BEAGLE_SOCKET', 'BEAGLE_TRACE', 'TERM'):
+            self.assertEqual(daemon.settings(dict(ENVIRON, **{name: 'changed'})), daemon.settings(ENVIRON), name)
+
+    def test_values_are_not_sent(self):
+        self.assertNotIn('http://lims', daemon.settings(ENVIRON))
+
+
+class ForwardToDaemonTest(unittest.TestCase):
+
+    def forwarded(self, argv, environ):
+        arguments = docopt(beaglecli.USAGE, argv=argv, help=False)
+        with mock.patch.dict(os.environ, environ, clear=True), \
+                mock.patch('apps.daemon.forward', return_value=0) as forward:
+            status = beaglecli._forward_to_daemon(argv, arguments)
+        return status, forward.call_args
+
+    def test_forwarding_is_opt_in(self):
+        self.assertEqual(self.forwarded(['run', 'get', '1'], ENVIRON), (None, None))
+        status, call = self.forwarded(['run', 'get', '1'], dict(ENVIRON, BEAGLE_DAEMON='1'))
+        self.assertEqual(status, 0)
+        self.assertEqual(call[0][1:], (['run', 'get', '1'], daemon.settings(ENVIRON)))
+
+    def test_commands_reading_stdin_run_here(self):
+        environ = dict(ENVIRON, BEAGLE_DAEMON='1')
+        for argv in (['files', 'delete', '--ids-file=-'], ['files', 'delete', '--ids-file', '-'],
+                     ['files', 'patch-batch', '-'], ['batch'], ['shell']):
+            self.assertEqual(self.forwarded(argv, environ), (None, None), argv)
+
+
+class AuthenticateTest(unittest.TestCase):
+
+    def test_without_prompt_a_missing_login_fails(self):
+        with mock.patch.object(beaglecli, '_check_is_authenticated', return_value=False), \
+                mock.patch.object(beaglecli, 'BEAGLE_USER', ''), \
+                mock.patch('builtins.input', side_effect=AssertionError("prompted")), \
+                mock.patch('getpass.getpass', side_effect=AssertionError("prompted")):
+            with self.assertRaises(SystemExit) as exit:
+                beaglecli.authenticate_command(object(), prompt=False)
+        self.assertIn("Not logged in", exit.exception.code)
+
+
+if __name__ == '__main__':
+    unittest.main()
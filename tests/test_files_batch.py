@@ -0,0 +1,174 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stderr
+from urllib.parse import urlencode
+
+from tests import load_beaglecli
+
+beaglecli = load_beaglecli()
+
+
+class Response(object):
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.body = body or {}
+        self.text = json.dumps(self.body)
+
+    def json(self):
+        return self.body
+
+
+class Client(object):
+    """Records the requests it gets and answers them with respond(method, path, data)."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def _request(self, method, path, data):
+        with self.lock:
+            self.requests.append((method, path, data))
+        return self.respond(method, path, data)
+
+    def post(self, path, data=None):
+        return self._request('POST', path, data)
+
+    def patch(self, path, data=None):
+        return self._request('PATCH', path, data)
+
+
+class Config(object):
+
+    def __init__(self, client):
+        self.client = client
+
+
+class FilesBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.errors = io.StringIO()
+
+    def write_table(self, name, header, rows):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as f:
+            f.write("\t".join(header) + "\n")
+            for row in rows:
+                f.write("\t".join(row) + "\n")
+        return path
+
+    def run_command(self, function, arguments, client):
+        arguments = dict({'--workers': '2'}, **arguments)
+        with redirect_stderr(self.errors):
+            return function(arguments, Config(client))
+
+    def read_log(self, path):
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class CreateFilesBatchTest(FilesBatchTest):
+
+    def setUp(self):
+        super().setUp()
+        self.manifest = self.write_table('delivery.tsv', ['path', 'file_type', 'file_group', 'metadata'], [
+            ['/data/%s.fastq' % name, 'fastq', 'group-1', '{"sample": "%s"}' % name] for name in 'abc'])
+        self.log = self.manifest + '.results.ndjson'
+
+    def create(self, client):
+        return self.run_command(beaglecli._create_files_batch, {'<manifest>': self.manifest}, client)
+
+    def test_results_are_logged_and_registered_paths_skipped_on_rerun(self):
+        def flaky(method, path, data):
+            if data['path'] == '/data/b.fastq':
+                return Response(400, {'path': ['already exists']})
+            return Response(201, {'id': 'id-' + data['path']})
+
+        result = self.create(Client(flaky))
+        self.assertTrue(result.startswith("Registered 2 of 3, 1 failed, 0 already registered"))
+        entries = {entry['path']: entry for entry in self.read_log(self.log)}
+        self.assertEqual(entries['/data/a.fastq'], {'path': '/data/a.fastq', 'status_code': 201,
+                                                    'id': 'id-/data/a.fastq', 'result': "Registered"})
+        self.assertEqual(entries['/data/b.fastq']['status_code'], 400)
+        self.assertTrue(entries['/data/b.fastq']['result'].startswith("Failed to be registered"))
+
+        client = Client(lambda method, path, data: Response(201, {'id': 'new'}))
+        result = self.create(client)
+        self.assertEqual([data['path'] for _, _, data in client.requests], ['/data/b.fastq'])
+        self.assertTrue(result.startswith("Registered 1 of 1, 0 failed, 2 already registered"))
+        # the log is appended to, so it keeps the outcome of both runs
+        self.assertEqual([entry['result'] for entry in self.read_log(self.log)].count("Registered"), 3)
+
+        client = Client(lambda method, path, data: Response(201, {'id': 'new'}))
+        result = self.create(client)
+        self.assertEqual(client.requests, [])
+        self.assertTrue(result.startswith("Registered 0 of 0, 0 failed, 3 already registered"))
+
+    def test_request_errors_are_logged_as_failures(self):
+        def broken(method, path, data):
+            raise IOError("connection reset")
+
+        result = self.create(Client(broken))
+        self.assertTrue(result.startswith("Registered 0 of 3, 3 failed"))
+        self.assertEqual({entry['status_code'] for entry in self.read_log(self.log)}, {None})
+
+    def test_body_carries_the_manifest_row(self):
+        client = Client(lambda method, path, data: Response(201, {'id': 'new'}))
+        self.create(client)
+        bodies = sorted((data for _, _, data in client.requests), key=lambda data: data['path'])
+        self.assertEqual(bodies[0], {'path': '/data/a.fastq', 'metadata': '{"sample": "a"}', 'file_group': 'group-1',
+                                     'file_type': 'fastq'})
+
+
+class PatchFilesBatchTest(FilesBatchTest):
+
+    def test_each_row_is_patched_once_and_summarized(self):
+        table = self.write_table('fixes.tsv', ['id', 'metadata.patientId'], [['f1', 'P-1'], ['f2', 'P-2']])
+        summary = os.path.join(self.root, 'fixes.ndjson')
+
+        def respond(method, path, data):
+            return Response(503 if path.endswith('f2/') else 200)
+
+        client = Client(respond)
+        result = self.run_command(beaglecli._patch_files_batch, {'<table>': table, '--summary-file': summary}, client)
+        self.assertEqual(result, "Patched 1 of 2, 1 failed")
+        # retries are left to the client's adapter
+        self.assertEqual(sorted(path for _, path, _ in client.requests),
+                         [beaglecli.API['files'] + 'f1/', beaglecli.API['files'] + 'f2/'])
+        entries = {entry['id']: entry for entry in self.read_log(summary)}
+        self.assertEqual(entries['f1']['result'], "Successfully patched")
+        self.assertEqual(entries['f2']['status_code'], 503)
+
+
+class ResolveFileIdsTest(unittest.TestCase):
+
+    def test_lookups_stay_under_the_query_size(self):
+        lookups = []
+
+        def paginate(path, params):
+            lookups.append(params['path'])
+            return [{'path': file_path, 'id': 'id-' + file_path} for file_path in params['path']]
+
+        client = Client(None)
+        client.paginate = paginate
+        rows = [{'path': '/juno/work/%s/%s.bam' % ('x' * 150, number)} for number in range(100)]
+        rows.insert(50, {'id': 'known', 'metadata.patientId': 'P-1'})
+        resolved = list(beaglecli._resolve_file_ids(iter(rows), Config(client)))
+        self.assertEqual([row['id'] for row in resolved],
+                         ['id-' + row['path'] if 'path' in row else row['id'] for row in rows])
+        self.assertGreater(len(lookups), 1)
+        for paths in lookups:
+            self.assertLessEqual(len(urlencode({'path': paths}, doseq=True)), 4000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+from tests import load_beaglecli
+
+beaglecli = load_beaglecli()
+
+INFO_KEYS = ['id', 'app', 'operator_run', 'created_date', 'tags']
+
+
+def run(run_id, operator_run, created_date, app='app-1', request_id='10000_A', **extra):
+    return dict({'id': run_id, 'app': app, 'operator_run': operator_run, 'created_date': created_date,
+                 'tags': {'igoRequestId': request_id}}, **extra)
+
+
+def select(runs):
+    return beaglecli._select_latest_runs(runs, INFO_KEYS)
+
+
+class SelectLatestRunsTest(unittest.TestCase):
+
+    def test_keeps_every_run_of_a_single_operator_run(self):
+        groups = select([run('r1', 'op1', '2024-01-01T00:00:00'), run('r2', 'op1', '2024-01-01T00:00:01')])
+        self.assertEqual(list(groups), ['app-1:10000_A'])
+        group = groups['app-1:10000_A']
+        self.assertEqual([r['id'] for r in group['runs']], ['r1', 'r2'])
+        self.assertTrue(group['complete'])
+
+    def test_only_info_keys_are_kept(self):
+        groups = select([run('r1', 'op1', '2024-01-01T00:00:00', outputs=[1, 2])])
+        self.assertEqual(set(groups['app-1:10000_A']['runs'][0]), set(INFO_KEYS))
+
+    def test_newer_operator_run_replaces_the_older_one(self):
+        groups = select([
+            run('a1', 'opA', '2024-01-01T00:00:00'),
+            run('b1', 'opB', '2024-01-02T00:00:00'),
+            run('a2', 'opA', '2024-01-01T00:00:01'),
+            run('b2', 'opB', '2024-01-02T00:00:01'),
+        ])
+        group = groups['app-1:10000_A']
+        self.assertEqual(group['operator_run'], 'opB')
+        self.assertEqual([r['id'] for r in group['runs']], ['b1', 'b2'])
+        self.assertTrue(group['complete'])
+
+    def test_older_operator_run_seen_later_is_dropped(self):
+        groups = select([run('b1', 'opB', '2024-01-02T00:00:00'), run('a1', 'opA', '2024-01-01T00:00:00')])
+        group = groups['app-1:10000_A']
+        self.assertEqual([r['id'] for r in group['runs']], ['b1'])
+        self.assertTrue(group['complete'])
+
+    def test_operator_run_taking_the_lead_after_being_dropped_is_incomplete(self):
+        groups = select([
+            run('b1', 'opB', '2024-01-01T00:00:00'),
+            run('a1', 'opA', '2024-01-02T00:00:00'),  # opA leads, b1 is dropped
+            run('b2', 'opB', '2024-01-03T00:00:00'),  # opB leads again without b1
+        ])
+        group = groups['app-1:10000_A']
+        self.assertEqual(group['operator_run'], 'opB')
+        self.assertEqual([r['id'] for r in group['runs']], ['b2'])
+        self.assertFalse(group['complete'])
+
+    def test_date_tie_keeps_the_first_operator_run(self):
+        groups = select([run('a1', 'opA', '2024-01-01T00:00:00'), run('b1', 'opB', '2024-01-01T00:00:00')])
+        group = groups['app-1:10000_A']
+        self.assertEqual(group['operator_run'], 'opA')
+        self.assertEqual([r['id'] for r in group['runs']], ['a1'])
+        self.assertTrue(group['complete'])
+
+    def test_apps_and_requests_are_grouped_apart(self):
+        groups = select([
+            run('r1', 'op1', '2024-01-01T00:00:00'),
+            run('r2', 'op2', '2024-01-02T00:00:00', app='app-2'),
+            run('r3', 'op3', '2024-01-03T00:00:00', request_id='10001_B'),
+            run('r4', 'op4', '2024-01-04T00:00:00', tags={}),
+        ])
+        self.assertEqual(sorted(groups), ['app-1:10000_A', 'app-1:10001_B', 'app-1:None', 'app-2:10000_A'])
+
+    def test_matches_brute_force_on_every_order(self):
+        from itertools import permutations
+        runs = [
+            run('a1', 'opA', '2024-01-01T00:00:00'),
+            run('a2', 'opA', '2024-01-03T00:00:00'),
+            run('b1', 'opB', '2024-01-02T00:00:00'),
+            run('b2', 'opB', '2024-01-02T12:00:00'),
+        ]
+        # opA has the most recent run, so it must win whatever the order, complete or not
+        for order in permutations(runs):
+            group = select(order)['app-1:10000_A']
+            self.assertEqual(group['operator_run'], 'opA')
+            if group['complete']:
+                self.assertEqual(sorted(r['id'] for r in group['runs']), ['a1', 'a2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from apps import lims
+from apps.cache import Cache
+
+
+class SamplesResponse(object):
+
+    def __init__(self, sample_ids):
+        self.sample_ids = sample_ids
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"samples": [{"igoSampleId": sample_id} for sample_id in self.sample_ids]}
+
+
+class LimsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.cache = Cache(os.path.join(root, 'lims.sqlite'))
+        self.session = mock.patch.object(lims, 'LIMS_SESSION').start()
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(lims, 'open_cache', return_value=self.cache).start()
+
+    def test_cache_is_off_unless_enabled(self):
+        with mock.patch.object(lims, 'LIMS_CACHE_ENABLED', False):
+            self.assertIsNone(lims.lims_cache())
+        with mock.patch.object(lims, 'LIMS_CACHE_ENABLED', True):
+            self.assertIs(lims.lims_cache(), self.cache)
+        lims.open_cache.assert_called_once_with('lims', max_bytes=lims.LIMS_CACHE_SIZE)
+
+    def test_responses_of_other_servers_are_not_reused(self):
+        mock.patch.object(lims, 'LIMS_CACHE_ENABLED', True).start()
+        self.session.get.side_effect = [SamplesResponse(['S1']), SamplesResponse(['S2'])]
+        with mock.patch.object(lims, 'LIMS_URL', 'https://lims-a/api'):
+            self.assertEqual(lims.get_samples_from_request('10000_A'), ['S1'])
+        with mock.patch.object(lims, 'LIMS_URL', 'https://lims-b/api'):
+            self.assertEqual(lims.get_samples_from_request('10000_A'), ['S2'])
+        with mock.patch.object(lims, 'LIMS_URL', 'https://lims-a/api'):
+            self.assertEqual(lims.get_samples_from_request('10000_A'), ['S1'])
+        self.assertEqual(self.session.get.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
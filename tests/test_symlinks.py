@@ -0,0 +1,161 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import mock
+
+from apps import symlinks
+from apps.symlinks import apply_plan, plan_links, reconcile_links
+
+
+class SymlinksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.output = io.StringIO()
+        self.errors = io.StringIO()
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def symlink(self, target, *parts):
+        os.makedirs(os.path.dirname(self.path(*parts)), exist_ok=True)
+        os.symlink(target, self.path(*parts))
+
+    def apply(self, plan, prune_dirs=()):
+        with redirect_stdout(self.output), redirect_stderr(self.errors):
+            apply_plan(plan, prune_dirs)
+
+    def reconcile(self, links, **kwargs):
+        with redirect_stdout(self.output), redirect_stderr(self.errors):
+            return reconcile_links(links, **kwargs)
+
+    def test_plans_links_against_what_is_on_disk(self):
+        self.symlink('/data/same', 'project', 'same')
+        self.symlink('/data/old', 'project', 'moved')
+        with open(self.path('project', 'file'), 'w'):
+            pass
+        plan = plan_links({
+            self.path('project', 'same'): '/data/same',
+            self.path('project', 'moved'): '/data/new',
+            self.path('project', 'file'): '/data/file',
+            self.path('project', 'new'): '/data/new',
+            self.path('other', 'new'): '/data/other',
+        })
+        self.assertEqual(plan.unchanged, 1)
+        self.assertEqual(plan.update, [(self.path('project', 'moved'), '/data/new', '/data/old')])
+        self.assertEqual(plan.conflicts, [self.path('project', 'file')])
+        self.assertEqual(sorted(plan.create), [(self.path('other', 'new'), '/data/other'),
+                                               (self.path('project', 'new'), '/data/new')])
+        self.assertEqual(plan.missing_dirs, {self.path('other')})
+        self.assertEqual(plan.delete, [])
+
+    def test_delete_plans_only_existing_links(self):
+        self.symlink('/data/a', 'project', 'a')
+        with open(self.path('project', 'file'), 'w'):
+            pass
+        plan = plan_links({self.path('project', 'a'): '/data/other', self.path('project', 'b'): '/data/b',
+                           self.path('project', 'file'): '/data/file'}, delete=True)
+        self.assertEqual(plan.delete, [(self.path('project', 'a'), '/data/a')])
+        self.assertEqual(plan.create, [])
+        self.assertEqual(plan.conflicts, [self.path('project', 'file')])
+
+    def test_apply_creates_missing_directories_and_links(self):
+        plan = plan_links({self.path('a', 'b', 'link'): '/data/target'})
+        self.apply(plan)
+        self.assertEqual(os.readlink(self.path('a', 'b', 'link')), '/data/target')
+        self.assertIn(self.path('a', 'b', 'link'), self.output.getvalue())
+
+    def test_apply_swaps_updated_links_through_a_temporary_link(self):
+        self.symlink('/data/old', 'project', 'current')
+        plan = plan_links({self.path('project', 'current'): '/data/new'})
+        with mock.patch('apps.symlinks.os.replace', wraps=os.replace) as replace, \
+                mock.patch('apps.symlinks.os.unlink', wraps=os.unlink) as unlink:
+            self.apply(plan)
+        self.assertEqual(os.readlink(self.path('project', 'current')), '/data/new')
+        (tmp_link, link), _ = replace.call_args
+        self.assertEqual(link, self.path('project', 'current'))
+        self.assertTrue(tmp_link.startswith(link + '.tmp-'))
+        unlink.assert_not_called()
+        self.assertEqual(os.listdir(self.path('project')), ['current'])
+
+    def test_apply_leaves_conflicts_in_place(self):
+        os.makedirs(self.path('project'))
+        with open(self.path('project', 'file'), 'w') as f:
+            f.write('data')
+        self.apply(plan_links({self.path('project', 'file'): '/data/file'}))
+        with open(self.path('project', 'file')) as f:
+            self.assertEqual(f.read(), 'data')
+        self.assertIn('is not a symlink', self.errors.getvalue())
+
+    def test_apply_reports_failures_and_continues(self):
+        os.makedirs(self.path('project'))
+        plan = plan_links({self.path('project', 'a'): '/data/a', self.path('project', 'b'): '/data/b'})
+        with mock.patch('apps.symlinks.os.symlink', side_effect=[OSError('denied'), None]):
+            self.apply(plan)
+        self.assertIn('could not create symlink', self.errors.getvalue())
+
+    def test_delete_prunes_emptied_directories(self):
+        self.symlink('/data/a', 'patient', 'sample', '1.0.0', 'a.bam')
+        self.symlink('/data/b', 'patient', 'kept', '1.0.0', 'b.bam')
+        with open(self.path('patient', 'kept', '1.0.0', 'notes.txt'), 'w'):
+            pass
+        links = {self.path('patient', 'sample', '1.0.0', 'a.bam'): '/data/a',
+                 self.path('patient', 'kept', '1.0.0', 'b.bam'): '/data/b'}
+        plan = self.reconcile(links, delete=True, prune_dirs=[self.path('patient', 'sample', '1.0.0'),
+                                                               self.path('patient', 'kept', '1.0.0')])
+        self.assertEqual(len(plan.delete), 2)
+        self.assertFalse(os.path.exists(self.path('patient', 'sample', '1.0.0')))
+        # directories that still hold other files are kept
+        self.assertEqual(os.listdir(self.path('patient', 'kept', '1.0.0')), ['notes.txt'])
+
+    def test_dry_run_prints_the_plan_without_changing_anything(self):
+        self.symlink('/data/old', 'project', 'current')
+        self.reconcile({self.path('project', 'current'): '/data/new', self.path('project', 'run'): '/data/run'},
+                       dry_run=True)
+        self.assertEqual(os.readlink(self.path('project', 'current')), '/data/old')
+        self.assertFalse(os.path.lexists(self.path('project', 'run')))
+        self.assertIn('update %s -> /data/new (was /data/old)' % self.path('project', 'current'),
+                      self.output.getvalue())
+        self.assertIn('create %s -> /data/run' % self.path('project', 'run'), self.output.getvalue())
+
+    def test_reconcile_is_idempotent(self):
+        links = {self.path('project', 'run'): '/data/run', self.path('project', 'current'): '/data/version'}
+        self.reconcile(links)
+        plan = self.reconcile(links)
+        self.assertEqual(plan.unchanged, 2)
+        self.assertEqual((plan.create, plan.update, plan.delete), ([], [], []))
+
+    def test_reconcile_holds_the_directory_lock(self):
+        links = {self.path('project', 'run'): '/data/run'}
+        directory = self.path('project')
+        plan_links = symlinks.plan_links
+        held = []
+
+        def planning(*args, **kwargs):
+            held.append(symlinks.DIRECTORY_LOCKS[directory].locked())
+            return plan_links(*args, **kwargs)
+
+        with mock.patch('apps.symlinks.plan_links', side_effect=planning):
+            self.reconcile(links)
+        self.assertEqual(held, [True])
+        self.assertFalse(symlinks.DIRECTORY_LOCKS[directory].locked())
+
+    def test_concurrent_reconciles_of_one_directory(self):
+        links = [{self.path('patient', 'sample', 'current'): '/data/%d' % i} for i in range(8)]
+        threads = [threading.Thread(target=reconcile_links, args=(link,)) for link in links]
+        with redirect_stdout(self.output), redirect_stderr(self.errors):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(os.listdir(self.path('patient', 'sample')), ['current'])
+        self.assertNotIn('could not', self.errors.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from apps.trace import Tracer
+
+
+class SummaryTest(unittest.TestCase):
+
+    def p95(self, durations):
+        tracer = Tracer()
+        for duration in durations:
+            tracer.record_call('GET', 'http://beagle/v0/fs/files/', 200, tracer.start, duration, duration, 0)
+        row = tracer.summary().splitlines()[1].split()
+        return float(row[-3])
+
+    def test_p95_is_the_nearest_rank(self):
+        self.assertEqual(self.p95([number / 1000.0 for number in range(1, 11)]), 10.0)
+        self.assertEqual(self.p95([number / 1000.0 for number in range(1, 21)]), 19.0)
+        self.assertEqual(self.p95([0.005]), 5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from apps import writers
+from apps.writers import write_rows
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def read_table(path, output_format):
+    if output_format == 'parquet':
+        return pyarrow.parquet.read_table(path)
+    with pyarrow.ipc.open_file(path) as reader:
+        return reader.read_all()
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class ArrowWritersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        # several batches out of a few rows
+        patcher = mock.patch.object(writers, 'BATCH_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, rows, output_format, columns=None):
+        path = os.path.join(self.root, 'out.' + output_format)
+        count = write_rows(iter(rows), path, output_format, columns)
+        return count, read_table(path, output_format)
+
+    def test_columns_first_seen_in_a_later_batch_are_kept(self):
+        rows = [{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4, 'metadata.patientId': 'P-1'}, {'id': 5}]
+        for output_format in ('parquet', 'arrow'):
+            count, table = self.write(rows, output_format)
+            self.assertEqual(count, 5)
+            self.assertEqual(table.column_names, ['id', 'metadata.patientId'])
+            self.assertEqual(table.column('metadata.patientId').to_pylist(), [None, None, None, 'P-1', None])
+            self.assertEqual(table.column('id').to_pylist(), [1, 2, 3, 4, 5])
+
+    def test_conflicting_types_in_a_later_batch_become_text(self):
+        rows = [{'size': 1, 'ok': True}, {'size': 2, 'ok': False}, {'size': 'unknown', 'ok': 1},
+                {'size': None, 'ok': None}]
+        for output_format in ('parquet', 'arrow'):
+            count, table = self.write(rows, output_format)
+            self.assertEqual(count, 4)
+            self.assertEqual(table.schema.field('size').type, pyarrow.string())
+            self.assertEqual(table.column('size').to_pylist(), ['1', '2', 'unknown', None])
+            self.assertEqual(table.column('ok').to_pylist(), ['True', 'False', '1', None])
+
+    def test_ints_and_floats_become_floats(self):
+        count, table = self.write([{'value': 1}, {'value': 2}, {'value': 2.5}], 'parquet')
+        self.assertEqual(table.schema.field('value').type, pyarrow.float64())
+        self.assertEqual(table.column('value').to_pylist(), [1.0, 2.0, 2.5])
+
+    def test_nested_values_are_stored_as_json(self):
+        count, table = self.write([{'tags': {'a': 1}}, {'tags': [1, 2]}, {'tags': None}], 'parquet')
+        self.assertEqual(table.column('tags').to_pylist(), ['{"a": 1}', '[1, 2]', None])
+
+    def test_given_columns_are_the_only_ones_written(self):
+        count, table = self.write([{'a': 1, 'b': 2}, {'a': 3, 'c': 4}, {}], 'arrow', columns=['b', 'a'])
+        self.assertEqual(table.column_names, ['b', 'a'])
+        self.assertEqual(table.column('b').to_pylist(), [2, None, None])
+
+    def test_no_rows_writes_an_empty_file_with_the_given_columns(self):
+        count, table = self.write([], 'parquet', columns=['id'])
+        self.assertEqual((count, table.num_rows, table.column_names), (0, 0, ['id']))
+
+
+class WriteRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, 'out.tsv')
+
+    def failing_rows(self):
+        yield {'id': 1}
+        raise ValueError("page 2 failed")
+
+    def test_failed_write_keeps_the_previous_file(self):
+        with open(self.path, 'w') as f:
+            f.write('previous')
+        formats = ('tsv', 'ndjson') + (('parquet', 'arrow') if pyarrow else ())
+        for output_format in formats:
+            with self.assertRaises(ValueError):
+                write_rows(self.failing_rows(), self.path, output_format)
+            with open(self.path) as f:
+                self.assertEqual(f.read(), 'previous')
+            self.assertEqual(os.listdir(self.root), ['out.tsv'])
+
+    def test_file_is_written_once_complete(self):
+        self.assertEqual(write_rows(iter([{'id': 1}, {'id': 2}]), self.path, 'tsv'), 2)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "redact(y/n)\tid\nn\t1\nn\t2\n")
+        self.assertEqual(os.listdir(self.root), ['out.tsv'])
+
+
+if __name__ == '__main__':
+    unittest.main()